@@ -6,7 +6,7 @@ import click
 from . import __version__, settings
 from . import configuration as conf
 from .operators.python_operator import PythonOperator
-from .tasks import extract, split
+from .tasks import extract, extract_batch, split
 from .utils.database import initialize_database, reset_database
 from .www.app import create_app
 
@@ -17,7 +17,7 @@ def abort_if_false(ctx, param, value):
 
 
 def _run(task_name, task_id):
-    task_bag = {"split": split, "extract": extract}
+    task_bag = {"split": split, "extract": extract, "extract_batch": extract_batch}
     python_callable = task_bag[task_name]
     task = PythonOperator(python_callable, op_args=[task_id])
     task.execute()
@@ -65,6 +65,22 @@ def webserver(*args, **kwargs):
 
 @cli.command("worker")
 def worker(*args, **kwargs):
+    if conf.get("core", "executor") == "DatabaseExecutor":
+        import multiprocessing
+
+        from .executors.database_executor import run_worker
+
+        concurrency = int(conf.get("database_executor", "worker_concurrency"))
+        workers = [
+            multiprocessing.Process(target=run_worker)
+            for __ in range(max(concurrency, 1))
+        ]
+        for process in workers:
+            process.start()
+        for process in workers:
+            process.join()
+        return
+
     from celery.bin import worker
 
     from .executors.celery_executor import app as celery_app
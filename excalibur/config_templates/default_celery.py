@@ -1,9 +1,14 @@
 from .. import configuration as conf
 
 broker_url = conf.get("celery", "BROKER_URL")
+# chords need a result backend, the metadata database is used by default
+result_backend = conf.get("celery", "RESULT_BACKEND") or "db+{}".format(
+    conf.get("core", "SQL_ALCHEMY_CONN")
+)
 
 DEFAULT_CELERY_CONFIG = {
     "broker_url": broker_url,
+    "result_backend": result_backend,
     "worker_prefetch_multiplier": 1,
     "task_acks_late": True,
     "task_create_missing_queues": True,
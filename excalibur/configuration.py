@@ -53,9 +53,13 @@ class ExcaliburConfigParser(ConfigParser):
         self.is_validated = False
 
     def _validate(self):
-        if self.get(
-            "core", "executor"
-        ) != "SequentialExecutor" and "sqlite" in self.get("core", "sql_alchemy_conn"):
+        # the local executors run on the same machine as the sqlite file, as
+        # do the workers of the DatabaseExecutor when it queues tasks there
+        if self.get("core", "executor") not in (
+            "SequentialExecutor",
+            "WorkerPoolExecutor",
+            "DatabaseExecutor",
+        ) and "sqlite" in self.get("core", "sql_alchemy_conn"):
             raise ValueError(
                 "Cannot use sqlite with the {}".format(self.get("core", "executor"))
             )
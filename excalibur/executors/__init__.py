@@ -2,14 +2,18 @@ import atexit
 
 from .. import configuration as conf
 from .celery_executor import CeleryExecutor
+from .database_executor import DatabaseExecutor
 from .sequential_executor import SequentialExecutor
+from .worker_pool_executor import WorkerPoolExecutor
 
 DEFAULT_EXECUTOR = None
 
 
 class Executors:
     CeleryExecutor = "CeleryExecutor"
+    DatabaseExecutor = "DatabaseExecutor"
     SequentialExecutor = "SequentialExecutor"
+    WorkerPoolExecutor = "WorkerPoolExecutor"
 
 
 def get_default_executor():
@@ -29,8 +33,12 @@ def configure_executor(executor_name):
     if DEFAULT_EXECUTOR is None:
         if executor_name == Executors.CeleryExecutor:
             DEFAULT_EXECUTOR = CeleryExecutor()
+        elif executor_name == Executors.DatabaseExecutor:
+            DEFAULT_EXECUTOR = DatabaseExecutor()
         elif executor_name == Executors.SequentialExecutor:
             DEFAULT_EXECUTOR = SequentialExecutor()
+        elif executor_name == Executors.WorkerPoolExecutor:
+            DEFAULT_EXECUTOR = WorkerPoolExecutor()
         else:
             raise NotImplementedError("Unknown executor")
 
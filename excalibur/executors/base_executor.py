@@ -1,3 +1,86 @@
+import datetime as dt
+
+from ..models import Task, TaskState
+from ..settings import Session
+from ..utils.metadata import generate_uuid
+
+
+class TaskHandle:
+    """Handle on a task that was sent to an executor.
+
+    The task's state and progress are read from the database, where the
+    task updates them as it moves from queued (and claimed, with the
+    DatabaseExecutor) to running, and then to succeeded or failed.
+
+    Parameters
+    ----------
+    task_id : str
+
+    """
+
+    def __init__(self, task_id):
+        self.task_id = task_id
+
+    def status(self):
+        """Returns the task's state and progress.
+
+        Returns
+        -------
+        status : dict
+            With the task's task_id, task_name, target_id, state,
+            total_pages, finished_pages, claimed_by, queued_at, started_at
+            and finished_at, or None if there is no such task.
+
+        """
+        session = Session()
+        task = session.query(Task).filter(Task.task_id == self.task_id).first()
+        session.close()
+        if task is None:
+            return None
+        return {
+            "task_id": task.task_id,
+            "task_name": task.task_name,
+            "target_id": task.target_id,
+            "state": task.state,
+            "total_pages": task.total_pages,
+            "finished_pages": task.finished_pages,
+            "claimed_by": task.claimed_by,
+            "queued_at": _isoformat(task.queued_at),
+            "started_at": _isoformat(task.started_at),
+            "finished_at": _isoformat(task.finished_at),
+        }
+
+    @property
+    def state(self):
+        status = self.status()
+        return status["state"] if status is not None else None
+
+
+def fail_task(task_id):
+    """Marks a task as failed if it has not ended, for a task whose
+    process died before it could mark itself.
+
+    Parameters
+    ----------
+    task_id : str
+
+    """
+    session = Session()
+    session.query(Task).filter(
+        Task.task_id == task_id,
+        Task.state.in_((TaskState.QUEUED, TaskState.CLAIMED, TaskState.RUNNING)),
+    ).update(
+        {Task.state: TaskState.FAILED, Task.finished_at: dt.datetime.now()},
+        synchronize_session=False,
+    )
+    session.commit()
+    session.close()
+
+
+def _isoformat(timestamp):
+    return timestamp.strftime("%Y-%m-%dT%H:%M:%S") if timestamp else None
+
+
 class BaseExecutor:
     def __init__(self):
         pass
@@ -10,3 +93,32 @@ class BaseExecutor:
 
     def stop(self):
         raise NotImplementedError()
+
+    def queue_task(self, command):
+        """Records a task as queued before it is sent to the workers.
+
+        Parameters
+        ----------
+        command : list
+            The task's command, of the form
+            ['excalibur', 'run', '--task', task_name, '--uuid', target_id].
+
+        Returns
+        -------
+        handle : TaskHandle
+
+        """
+        task_id = generate_uuid()
+        session = Session()
+        session.add(
+            Task(
+                task_id=task_id,
+                task_name=command[-3],
+                target_id=command[-1],
+                state=TaskState.QUEUED,
+                queued_at=dt.datetime.now(),
+            )
+        )
+        session.commit()
+        session.close()
+        return TaskHandle(task_id)
@@ -1,12 +1,23 @@
+import datetime as dt
+import json
+import logging
+import os
+import shutil
 import sys
 import traceback
 import subprocess
 
-from celery import Celery
+from celery import Celery, chord
 
 from .. import configuration as conf
-from .base_executor import BaseExecutor
+from .. import tasks
+from .base_executor import BaseExecutor, fail_task
+from ..models import Batch, File, Job, Rule, TaskState
+from ..settings import Session
+from ..utils.export import ResultWriter
+from ..utils.file import mkdirs
 from ..utils.module_loading import import_string
+from ..utils.render import close_document, open_document
 from ..config_templates.default_celery import DEFAULT_CELERY_CONFIG
 
 if conf.has_option("celery", "celery_config_options"):
@@ -21,13 +32,345 @@ app = Celery(
 
 
 @app.task
-def execute_command(command):
+def execute_command(command, task_id=None):
     try:
         subprocess.check_call(
             command, stderr=subprocess.STDOUT, close_fds=(sys.platform != "win32")
         )
+    except Exception:
+        traceback.print_exc()
+        # the task's process died, or exited before it could end the task
+        if task_id is not None:
+            fail_task(task_id)
+
+
+def _chunks(units):
+    # splits (page, pagepath) units into lists of [page_chunk_size] units
+    size = max(int(conf.get("celery", "page_chunk_size")), 1)
+    return [units[i : i + size] for i in range(0, len(units), size)]
+
+
+@app.task
+def split_pages(task_id, file_id, filepath, units):
+    """Renders the pages of a chunk and detects their table areas, or
+    only renders them when table areas are detected lazily.
+
+    Parameters
+    ----------
+    task_id : str
+        The split task that every page is counted on.
+    file_id : str
+    filepath : str
+        Path to the uploaded PDF that the pages are rendered from.
+    units : list
+        Lists of the form [page, pagepath].
+
+    Returns
+    -------
+    results : list
+        Lists of the form [page, pagepath].
+
+    """
+    session = Session()
+    lazy = conf.get("core", "table_detection") == "lazy"
+    open_document(filepath)
+    try:
+        file = session.query(File).filter(File.file_id == file_id).first()
+        # every page is persisted in a row of its own as soon as it is
+        # ready, so that chunks do not wait on each other and the
+        # workspace can show it before the whole split finishes
+        for page, pagepath in units:
+            if lazy:
+                result = tasks._render_page(pagepath, page)
+                tasks._store_page(session, file, page, result)
+            else:
+                result = tasks._split_page(pagepath, page)
+                tasks._store_page(session, file, page, result)
+                tasks._index_page(session, file, page, result)
+                tasks._update_task(session, task_id, finished_pages=1)
+            session.commit()
+        return units
+    except Exception:
+        fail_task(task_id)
+        raise
+    finally:
+        close_document()
+        session.close()
+
+
+@app.task
+def detect_pages(task_id, file_id, units):
+    """Detects the table areas of the pages of a chunk, that were rendered
+    without them since they are detected lazily.
+
+    Parameters
+    ----------
+    task_id : str
+        The split task that every page is counted on.
+    file_id : str
+    units : list
+        Lists of the form [page, pagepath].
+
+    Returns
+    -------
+    results : list
+        Lists of the form [page, pagepath].
+
+    """
+    session = Session()
+    try:
+        file = session.query(File).filter(File.file_id == file_id).first()
+        pages = tasks.get_file_pages(
+            session, file_id, pages=[page for page, pagepath in units]
+        )
+        for page, pagepath in units:
+            result = pages[page]
+            result["detected_areas"] = tasks._detect_page(pagepath)
+            tasks._store_areas(session, file_id, page, result["detected_areas"])
+            tasks._index_page(session, file, page, result)
+            tasks._update_task(session, task_id, finished_pages=1)
+            session.commit()
+        return units
+    except Exception:
+        fail_task(task_id)
+        raise
+    finally:
+        session.close()
+
+
+@app.task
+def finish_split(results, task_id, file_id):
+    """Ends the split once every chunk is rendered, or when table areas
+    are detected lazily, first detects them with one detect_pages task
+    per chunk, that run across all workers like split_pages.
+    """
+    session = Session()
+    try:
+        units = [unit for chunk in results for unit in chunk]
+        if conf.get("core", "table_detection") == "lazy" and units:
+            file = session.query(File).filter(File.file_id == file_id).first()
+            # pages that are open in the workspace go first
+            requested = json.loads(file.requested_pages or "[]")
+            units.sort(key=lambda unit: (unit[0] not in requested, unit[0]))
+            session.close()
+            header = [
+                detect_pages.s(task_id, file_id, chunk) for chunk in _chunks(units)
+            ]
+            chord(header)(end_split.s(task_id))
+            return
+        tasks._end_task(session, task_id, TaskState.SUCCEEDED)
+        session.close()
+    except Exception as e:
+        logging.exception(e)
+        tasks._end_task(session, task_id, TaskState.FAILED)
+
+
+@app.task
+def end_split(results, task_id):
+    """Ends a split whose table areas were detected lazily."""
+    session = Session()
+    tasks._end_task(session, task_id, TaskState.SUCCEEDED)
+    session.close()
+
+
+@app.task
+def split(file_id):
+    """Splits a file with one split_pages task per chunk of pages, that
+    run across all workers and are finished by finish_split.
+    """
+    session = Session()
+    task_id = tasks._start_task(session, "split", file_id)
+    try:
+        file = session.query(File).filter(File.file_id == file_id).first()
+        extract_pages, indexed, new_pages, outpaths = tasks._prepare_split(
+            session, file
+        )
+        filepath = file.filepath
+        # pages that were split from an upload with the same content are
+        # shown right away
+        for page, result in indexed.items():
+            tasks._store_page(session, file, page, result)
+        tasks._update_task(
+            session,
+            task_id,
+            total_pages=len(extract_pages),
+            finished_pages=len(extract_pages) - len(new_pages),
+        )
+        session.commit()
+        session.close()
+
+        units = [[page, outpaths[page]] for page in new_pages]
+        if units:
+            header = [
+                split_pages.s(task_id, file_id, filepath, chunk)
+                for chunk in _chunks(units)
+            ]
+            chord(header)(finish_split.s(task_id, file_id))
+        else:
+            finish_split([], task_id, file_id)
+    except Exception as e:
+        logging.exception(e)
+        tasks._end_task(session, task_id, TaskState.FAILED)
+
+
+def _get_rule_options(session, job):
+    rule = session.query(Rule).filter(Rule.rule_id == job.rule_id).first()
+    return json.loads(rule.rule_options)
+
+
+@app.task
+def extract_pages(task_id, job_id, partpath, units):
+    """Extracts tables from the pages of a chunk into a partial result.
+
+    Parameters
+    ----------
+    task_id : str
+        The extract or extract_batch task that every page is counted on.
+    job_id : str
+    partpath : str
+        Path to the Parquet file that the chunk's tables are written to.
+    units : list
+        Lists of the form [page, pagepath].
+
+    Returns
+    -------
+    results : list
+        Lists of the form [page, tables], where tables are the entries
+        of the page's tables in the partial result.
+
+    """
+    session = Session()
+    try:
+        job = session.query(Job).filter(Job.job_id == job_id).first()
+        page_kwargs = tasks._get_page_kwargs(_get_rule_options(session, job))
+
+        results = []
+        with ResultWriter(partpath) as writer:
+            for page, pagepath in units:
+                tables = tasks._extract_page(pagepath, page_kwargs[page])
+                results.append([page, tasks._write_page(writer, page, tables)])
+                tasks._update_task(session, task_id, finished_pages=1)
+                session.commit()
+        return results
+    except Exception:
+        fail_task(task_id)
+        raise
+    finally:
+        session.close()
+
+
+@app.task
+def finish_extract(results, task_id, job_id, plan, batch_id=None):
+    """Assembles a job's result from the partial results of its chunks,
+    and counts the job as finished on its batch.
+    """
+    session = Session()
+    try:
+        job = session.query(Job).filter(Job.job_id == job_id).first()
+        file = session.query(File).filter(File.file_id == job.file_id).first()
+        page_kwargs = tasks._get_page_kwargs(_get_rule_options(session, job))
+
+        parts = {}
+        for (partpath, __), chunk in zip(plan.get("parts", []), results):
+            for page, tables in chunk:
+                parts[page] = (partpath, tables)
+
+        def write_page(writer, page):
+            partpath, tables = parts[page]
+            writer.copy_page(partpath, int(page))
+            return tables
+
+        tasks._finish_job(session, job, file, plan, page_kwargs, write_page)
+        shutil.rmtree(os.path.join(plan["datapath"], "parts"), ignore_errors=True)
+
+        if batch_id is not None:
+            session.query(Batch).filter(Batch.batch_id == batch_id).update(
+                {Batch.finished_jobs: Batch.finished_jobs + 1}
+            )
+            session.commit()
+            batch = session.query(Batch).filter(Batch.batch_id == batch_id).first()
+            if batch.finished_jobs >= batch.total_jobs:
+                batch.is_finished = True
+                batch.finished_at = dt.datetime.now()
+                session.commit()
+                tasks._end_task(session, task_id, TaskState.SUCCEEDED)
+        else:
+            tasks._end_task(session, task_id, TaskState.SUCCEEDED)
+        session.close()
+    except Exception as e:
+        logging.exception(e)
+        tasks._end_task(session, task_id, TaskState.FAILED)
+
+
+def _extract_job(session, task_id, job, file, rule_options, batch_id=None):
+    # plans a job and fans its pages out to extract_pages tasks, whose
+    # partial results are assembled by finish_extract. pages that are
+    # not parsed again count as finished right away.
+    page_kwargs = tasks._get_page_kwargs(rule_options)
+    plan = tasks._plan_job(session, job, file, rule_options, page_kwargs)
+    tasks._update_task(
+        session,
+        task_id,
+        total_pages=len(plan["pages"]),
+        finished_pages=len(plan["pages"]) - len(plan["units"]),
+    )
+    session.commit()
+    if not plan["units"]:
+        finish_extract([], task_id, job.job_id, plan, batch_id)
+        return
+
+    # every chunk writes its tables to a partial result in the job's
+    # data directory, which is shared by all workers
+    partdir = os.path.join(plan["datapath"], "parts")
+    mkdirs(partdir)
+    plan["parts"] = [
+        [os.path.join(partdir, f"{i}.parquet"), chunk]
+        for i, chunk in enumerate(_chunks(plan["units"]))
+    ]
+    header = [
+        extract_pages.s(task_id, job.job_id, path, chunk)
+        for path, chunk in plan["parts"]
+    ]
+    chord(header)(finish_extract.s(task_id, job.job_id, plan, batch_id))
+
+
+@app.task
+def extract(job_id):
+    session = Session()
+    task_id = tasks._start_task(session, "extract", job_id)
+    try:
+        job = session.query(Job).filter(Job.job_id == job_id).first()
+        file = session.query(File).filter(File.file_id == job.file_id).first()
+        _extract_job(session, task_id, job, file, _get_rule_options(session, job))
+        session.close()
+    except Exception as e:
+        logging.exception(e)
+        tasks._end_task(session, task_id, TaskState.FAILED)
+
+
+@app.task
+def extract_batch(batch_id):
+    session = Session()
+    task_id = tasks._start_task(session, "extract_batch", batch_id)
+    try:
+        batch = session.query(Batch).filter(Batch.batch_id == batch_id).first()
+        rule = session.query(Rule).filter(Rule.rule_id == batch.rule_id).first()
+        rule_options = json.loads(rule.rule_options)
+        for file_id in json.loads(batch.file_ids):
+            job = (
+                session.query(Job)
+                .filter(Job.batch_id == batch_id, Job.file_id == file_id)
+                .first()
+            )
+            file = session.query(File).filter(File.file_id == file_id).first()
+            _extract_job(session, task_id, job, file, rule_options, batch_id=batch_id)
+        session.close()
     except Exception as e:
-        traceback.print_exc(e)
+        logging.exception(e)
+        tasks._end_task(session, task_id, TaskState.FAILED)
+
+
+TASKS = {"split": split, "extract": extract, "extract_batch": extract_batch}
 
 
 class CeleryExecutor(BaseExecutor):
@@ -38,7 +381,15 @@ class CeleryExecutor(BaseExecutor):
         pass
 
     def execute_async(self, command):
-        execute_command.apply_async(args=[command])
+        # tasks are sent as native celery tasks that fan out per page, the
+        # command is only kept for tasks that have none
+        handle = self.queue_task(command)
+        task_name, task_id = command[-3], command[-1]
+        if task_name in TASKS:
+            TASKS[task_name].apply_async(args=[task_id])
+        else:
+            execute_command.apply_async(args=[command, handle.task_id])
+        return handle
 
     def stop(self):
         pass
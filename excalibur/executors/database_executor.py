@@ -0,0 +1,222 @@
+import datetime as dt
+import os
+import socket
+import threading
+import time
+import traceback
+
+from sqlalchemy import and_, case, func, or_, text
+
+from .. import configuration as conf
+from .. import settings
+from .base_executor import BaseExecutor, fail_task
+from .worker_pool_executor import PRIORITIES
+from ..models import Task, TaskState
+
+
+def _expired(session, lease_timeout):
+    # claimed or running tasks whose worker stopped renewing its lease.
+    # heartbeats are timed by the database's clock, since the clocks of
+    # the nodes that workers run on may disagree.
+    now = session.query(func.now()).scalar()
+    expired = now - dt.timedelta(seconds=lease_timeout)
+    return and_(
+        Task.state.in_((TaskState.CLAIMED, TaskState.RUNNING)),
+        Task.heartbeat_at < expired,
+    )
+
+
+def claim_tasks(session, worker_name, limit, lease_timeout=None, max_attempts=None):
+    """Claims the next queued tasks for a worker.
+
+    Tasks are claimed in the order of the WorkerPoolExecutor's priority
+    lanes, and in the order they were queued within a lane. Where the
+    database supports it, the rows are selected with FOR UPDATE SKIP
+    LOCKED so that workers on other nodes skip them instead of waiting.
+    Every row is claimed with an update that only matches a claimable
+    task, so that a task is never claimed twice on databases without row
+    locks, like SQLite. The workers that lose such a race look again.
+
+    A claimed or running task whose last heartbeat is older than
+    lease_timeout is taken to be orphaned by a worker that died, and is
+    claimed again, unless it was already claimed max_attempts times, in
+    which case it is marked as failed, since it most likely took its
+    workers down with it.
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.Session
+    worker_name : str
+        Stored on the claimed tasks as claimed_by.
+    limit : int
+        Maximum number of tasks to claim.
+    lease_timeout : float, optional (default: None)
+        Seconds after its last heartbeat that a claimed or running task
+        is claimed again. Defaults to [database_executor] lease_timeout.
+    max_attempts : int, optional (default: None)
+        Number of times that a task is claimed before it is failed.
+        Defaults to [database_executor] max_attempts.
+
+    Returns
+    -------
+    tasks : list
+        Tuples of the form (task_id, task_name, target_id).
+
+    """
+    if lease_timeout is None:
+        lease_timeout = float(conf.get("database_executor", "lease_timeout"))
+    if max_attempts is None:
+        max_attempts = int(conf.get("database_executor", "max_attempts"))
+    session.query(Task).filter(
+        _expired(session, lease_timeout), Task.attempts >= max_attempts
+    ).update(
+        {Task.state: TaskState.FAILED, Task.finished_at: dt.datetime.now()},
+        synchronize_session=False,
+    )
+    session.commit()
+    priority = case(PRIORITIES, value=Task.task_name, else_=len(PRIORITIES))
+    tasks = []
+    while not tasks:
+        claimable = or_(
+            Task.state == TaskState.QUEUED, _expired(session, lease_timeout)
+        )
+        queued = (
+            session.query(Task.task_id, Task.task_name, Task.target_id)
+            .filter(claimable)
+            .order_by(priority, Task.queued_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        if not queued:
+            break
+        for task_id, task_name, target_id in queued:
+            claimed = (
+                session.query(Task)
+                .filter(Task.task_id == task_id, claimable)
+                .update(
+                    {
+                        Task.state: TaskState.CLAIMED,
+                        Task.claimed_by: worker_name,
+                        Task.heartbeat_at: func.now(),
+                        Task.attempts: Task.attempts + 1,
+                    },
+                    synchronize_session=False,
+                )
+            )
+            if claimed:
+                tasks.append((task_id, task_name, target_id))
+        # when another worker claimed every one of these first, look
+        # again at what is left
+        session.commit()
+    return tasks
+
+
+def renew_lease(session, worker_name):
+    """Records a heartbeat on the claimed and running tasks of a worker,
+    so that no other worker claims them again.
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.Session
+    worker_name : str
+
+    """
+    session.query(Task).filter(
+        Task.claimed_by == worker_name,
+        Task.state.in_((TaskState.CLAIMED, TaskState.RUNNING)),
+    ).update({Task.heartbeat_at: func.now()}, synchronize_session=False)
+    session.commit()
+
+
+def _heartbeat(worker_name, interval):
+    while True:
+        time.sleep(interval)
+        session = settings.Session()
+        try:
+            renew_lease(session, worker_name)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            session.close()
+
+
+def run_tasks(tasks):
+    """Runs claimed tasks one after the other.
+
+    A task that fails before it could end itself, for example when it
+    cannot be started, or when there is no task of its name, is marked as
+    failed, since the worker would otherwise renew its lease forever.
+
+    Parameters
+    ----------
+    tasks : list
+        Tuples of the form (task_id, task_name, target_id).
+
+    """
+    from ..cli import _run
+
+    for task_id, task_name, target_id in tasks:
+        try:
+            _run(task_name, target_id)
+        except Exception:
+            traceback.print_exc()
+            fail_task(task_id)
+
+
+def run_worker():
+    """Claims tasks from the metadata database and runs them, until the
+    process is stopped.
+
+    The worker claims up to [database_executor] claim_size tasks at a
+    time, and checks for new tasks every poll_interval seconds when there
+    are none. A thread renews the lease on its tasks every
+    heartbeat_interval seconds.
+    """
+    worker_name = f"{socket.gethostname()}:{os.getpid()}"
+    claim_size = max(int(conf.get("database_executor", "claim_size")), 1)
+    poll_interval = float(conf.get("database_executor", "poll_interval"))
+    heartbeat_interval = float(conf.get("database_executor", "heartbeat_interval"))
+    threading.Thread(
+        target=_heartbeat, args=(worker_name, heartbeat_interval), daemon=True
+    ).start()
+    while True:
+        session = settings.Session()
+        tasks = claim_tasks(session, worker_name, claim_size)
+        session.close()
+        if not tasks:
+            time.sleep(poll_interval)
+            continue
+        run_tasks(tasks)
+
+
+def use_wal():
+    """Switches a SQLite metadata database to write-ahead logging, so that
+    the webserver can read it while workers write to it.
+    """
+    if settings.engine.dialect.name == "sqlite":
+        with settings.engine.connect() as connection:
+            connection.execute(text("PRAGMA journal_mode=WAL"))
+
+
+class DatabaseExecutor(BaseExecutor):
+    """Queues tasks in the metadata database, from where they are claimed
+    by the workers that "excalibur worker" starts on any node.
+
+    The tasks table is the queue, so this needs no broker. Use Postgres
+    for workers on several nodes, or SQLite for workers on the same
+    machine as the webserver.
+    """
+
+    def __init__(self):
+        self.start()
+
+    def start(self):
+        use_wal()
+
+    def execute_async(self, command):
+        # the queued task is picked up by the next worker that polls
+        return self.queue_task(command)
+
+    def stop(self):
+        pass
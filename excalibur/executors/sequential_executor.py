@@ -1,12 +1,14 @@
+import functools
 import sys
 import traceback
 import subprocess
 from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
-from .base_executor import BaseExecutor
+from .base_executor import BaseExecutor, fail_task
 
 
-def execute_command(command):
+def execute_command(command, task_id=None):
     try:
         subprocess.check_call(
             command, stderr=subprocess.STDOUT, close_fds=(sys.platform != "win32")
@@ -16,11 +18,12 @@ def execute_command(command):
         # https://github.com/pyinstaller/pyinstaller/issues/305
         from ..cli import _run
 
-        task_name = command[-3]
-        task_id = command[-1]
-        _run(task_name, task_id)
-    except Exception as e:
-        traceback.print_exc(e)
+        _run(command[-3], command[-1])
+    except Exception:
+        traceback.print_exc()
+        # the task's process died, or exited before it could end the task
+        if task_id is not None:
+            fail_task(task_id)
 
 
 class SequentialExecutor(BaseExecutor):
@@ -31,7 +34,20 @@ class SequentialExecutor(BaseExecutor):
         self.pool = ProcessPoolExecutor(1)
 
     def execute_async(self, command):
-        self.pool.submit(execute_command, command)
+        handle = self.queue_task(command)
+        future = self.pool.submit(execute_command, command, handle.task_id)
+        future.add_done_callback(
+            functools.partial(self.check, self.pool, handle.task_id)
+        )
+        return handle
+
+    def check(self, pool, task_id, future):
+        # a task that was run in the pool's process took the process down
+        # with it, which breaks the pool and every task still queued on it
+        if isinstance(future.exception(), BrokenProcessPool):
+            fail_task(task_id)
+            if pool is self.pool:
+                self.start()
 
     def stop(self):
         self.pool.shutdown(wait=True)
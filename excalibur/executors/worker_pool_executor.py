@@ -0,0 +1,197 @@
+import collections
+import heapq
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+from queue import Empty
+
+from .. import configuration as conf
+from .base_executor import BaseExecutor, fail_task
+from ..utils.scheduler import start_scheduler, stop_scheduler
+from ..utils.task import get_concurrency
+
+# tasks that a user is waiting on go ahead of bulk extraction, lower
+# numbers first and tasks that are not listed last
+PRIORITIES = {"split": 0, "extract": 1, "extract_batch": 2}
+
+# seconds between the dispatcher's checks for workers that died
+REAP_INTERVAL = 5
+
+
+def run_worker(ready, queue, threads=1):
+    """Runs tasks from the queue until it gets None.
+
+    Importing the cli imports the tasks along with camelot, pandas and
+    SQLAlchemy, so that is only paid for once per worker. The worker
+    puts a tuple of the form (pid, finished) on the ready queue whenever
+    it can take a task, where finished is the id of the task that it
+    just finished, if any.
+
+    Parameters
+    ----------
+    ready : multiprocessing.Queue
+    queue : multiprocessing.Queue
+        The worker's own queue of tuples of the form
+        (task_name, target_id, task_id).
+    threads : int, optional (default: 1)
+        Number of tasks that the worker runs at once. Their pages go
+        through a page scheduler that they share.
+
+    """
+    from ..cli import _run
+
+    if threads > 1:
+        start_scheduler(
+            max(
+                get_concurrency("split_concurrency"),
+                get_concurrency("extract_concurrency"),
+            )
+        )
+
+    pid = os.getpid()
+
+    def run_tasks():
+        finished = None
+        while True:
+            ready.put((pid, finished))
+            task = queue.get()
+            if task is None:
+                break
+            task_name, target_id, finished = task
+            try:
+                _run(task_name, target_id)
+            except Exception:
+                traceback.print_exc()
+
+    runners = [threading.Thread(target=run_tasks) for __ in range(threads)]
+    for runner in runners:
+        runner.start()
+    for runner in runners:
+        runner.join()
+    # the scheduler's pool would otherwise keep the worker from exiting
+    stop_scheduler()
+
+
+class WorkerPoolExecutor(BaseExecutor):
+    """Runs tasks in long-lived worker processes by calling them through
+    the cli's _run, instead of starting an "excalibur run" process for
+    every task.
+
+    The number of workers is set by the [core] executor_concurrency
+    option. They are started when the first task is submitted. A worker
+    that dies is replaced when the next task is submitted, or when the
+    dispatcher finds it dead, and the tasks it was running are marked as
+    failed.
+
+    Submitted tasks wait in priority lanes, and a task is only handed to
+    a worker once one is idle, so that a split submitted behind a queue
+    of extracts runs next.
+
+    With [core] executor_threads above 1, each worker runs that many
+    tasks at once, and their pages take turns in a pool that they share.
+    """
+
+    def __init__(self):
+        self.concurrency = max(int(conf.get("core", "executor_concurrency")), 1)
+        self.threads = max(int(conf.get("core", "executor_threads")), 1)
+        # spawn gives the workers a clean interpreter instead of a copy of
+        # the webserver with its threads and open connections
+        self.context = multiprocessing.get_context("spawn")
+        self.ready = None
+        self.workers = {}
+        # every worker has a queue of its own, since a worker that dies
+        # while it waits on a shared queue takes the queue's lock with it
+        self.queues = {}
+        # ids of the tasks that were handed to each worker and have not
+        # finished, by pid
+        self.held = {}
+        self.idle = collections.deque()
+        self.lanes = []
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.starting = threading.Lock()
+        self.stopping = False
+        self.dispatcher = None
+
+    def start(self):
+        # tasks are submitted from the webserver's request threads
+        with self.starting:
+            if self.ready is None:
+                self.ready = self.context.Queue()
+                self.dispatcher = threading.Thread(target=self.dispatch, daemon=True)
+                self.dispatcher.start()
+            for pid, worker in list(self.workers.items()):
+                if not worker.is_alive():
+                    del self.workers[pid], self.queues[pid]
+                    # the tasks of a worker that died would never end
+                    for task_id in self.held.pop(pid, ()):
+                        fail_task(task_id)
+            while len(self.workers) < self.concurrency:
+                queue = self.context.Queue()
+                worker = self.context.Process(
+                    target=run_worker, args=(self.ready, queue, self.threads)
+                )
+                worker.start()
+                self.workers[worker.pid] = worker
+                self.queues[worker.pid] = queue
+
+    def dispatch(self):
+        """Hands the next task in the highest priority lane to each worker
+        that becomes idle, until the executor is stopped and every lane
+        is empty.
+        """
+        reaped = time.monotonic()
+        while True:
+            try:
+                pid, finished = self.ready.get(timeout=REAP_INTERVAL)
+            except Empty:
+                pid, finished = None, None
+            if time.monotonic() - reaped >= REAP_INTERVAL:
+                # fails the tasks of workers that died, and replaces them
+                self.start()
+                reaped = time.monotonic()
+            with self.lock, self.starting:
+                # a message without a pid only wakes the dispatcher
+                if pid is not None:
+                    self.held.setdefault(pid, set()).discard(finished)
+                    self.idle.append(pid)
+                while self.idle and self.lanes:
+                    pid = self.idle.popleft()
+                    if pid not in self.queues:
+                        continue
+                    __, __, task = heapq.heappop(self.lanes)
+                    self.held[pid].add(task[-1])
+                    self.queues[pid].put(task)
+                if self.stopping and not self.lanes:
+                    break
+
+    def execute_async(self, command):
+        handle = self.queue_task(command)
+        self.start()
+        task_name, target_id = command[-3], command[-1]
+        priority = PRIORITIES.get(task_name, len(PRIORITIES))
+        task = (task_name, target_id, handle.task_id)
+        with self.lock:
+            heapq.heappush(self.lanes, (priority, next(self.counter), task))
+        self.ready.put((None, None))
+        return handle
+
+    def stop(self):
+        if self.dispatcher is None:
+            return
+        # replace dead workers so that the tasks left in the lanes still run
+        self.start()
+        with self.lock:
+            self.stopping = True
+        self.ready.put((None, None))
+        self.dispatcher.join()
+        for queue in self.queues.values():
+            for __ in range(self.threads):
+                queue.put(None)
+        for worker in self.workers.values():
+            worker.join()
+        self.workers = {}
+        self.queues = {}
@@ -22,6 +22,7 @@ class File(Base):
     __tablename__ = "files"
 
     file_id = Column(String(ID_LEN), primary_key=True)
+    file_hash = Column(String(ID_LEN), index=True)
     uploaded_at = Column(DateTime)
     pages = Column(String(STR_LEN))
     total_pages = Column(Integer)
@@ -29,15 +30,44 @@ class File(Base):
     filename = Column(String(STR_LEN))
     filepath = Column(String(STR_LEN))
     has_image = Column(Boolean, default=False)
-    filenames = Column(Text)
-    filepaths = Column(Text)
-    imagenames = Column(Text)
-    imagepaths = Column(Text)
+    requested_pages = Column(Text)
+
+
+class FilePage(Base):
+    __tablename__ = "file_pages"
+
+    file_id = Column(String(ID_LEN), ForeignKey("files.file_id"), primary_key=True)
+    page = Column(Integer, primary_key=True)
+    filepath = Column(String(STR_LEN))
+    imagepath = Column(String(STR_LEN))
+    thumbnailpath = Column(String(STR_LEN))
+    filedims = Column(Text)
+    imagedims = Column(Text)
+    detected_areas = Column(Text, default=None)
+    updated_at = Column(DateTime, index=True)
+
+
+class Page(Base):
+    __tablename__ = "pages"
+
+    file_hash = Column(String(ID_LEN), primary_key=True)
+    page = Column(Integer, primary_key=True)
+    filepath = Column(String(STR_LEN))
+    imagepath = Column(String(STR_LEN))
+    thumbnailpath = Column(String(STR_LEN))
     filedims = Column(Text)
     imagedims = Column(Text)
     detected_areas = Column(Text)
 
 
+class Result(Base):
+    __tablename__ = "results"
+
+    result_key = Column(String(ID_LEN), primary_key=True)
+    render_files = Column(Text)
+    created_at = Column(DateTime)
+
+
 class Rule(Base):
     __tablename__ = "rules"
 
@@ -53,8 +83,49 @@ class Job(Base):
     job_id = Column(String(ID_LEN), primary_key=True)
     datapath = Column(String(STR_LEN), default=None)
     render_files = Column(Text, default=json.dumps([]))
+    page_options = Column(Text)
     is_finished = Column(Boolean, default=False)
     started_at = Column(DateTime)
     finished_at = Column(DateTime, default=dt.datetime.now())
     file_id = Column(String(ID_LEN), ForeignKey("files.file_id"))
     rule_id = Column(String(ID_LEN), ForeignKey("rules.rule_id"))
+    batch_id = Column(String(ID_LEN), ForeignKey("batches.batch_id"), default=None)
+
+
+class Batch(Base):
+    __tablename__ = "batches"
+
+    batch_id = Column(String(ID_LEN), primary_key=True)
+    rule_id = Column(String(ID_LEN), ForeignKey("rules.rule_id"))
+    file_ids = Column(Text)
+    datapath = Column(String(STR_LEN), default=None)
+    total_jobs = Column(Integer)
+    finished_jobs = Column(Integer, default=0)
+    is_finished = Column(Boolean, default=False)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime, default=None)
+
+
+class TaskState:
+    QUEUED = "queued"
+    CLAIMED = "claimed"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+class Task(Base):
+    __tablename__ = "tasks"
+
+    task_id = Column(String(ID_LEN), primary_key=True)
+    task_name = Column(String(STR_LEN))
+    target_id = Column(String(ID_LEN), index=True)
+    state = Column(String(STR_LEN), default=TaskState.QUEUED, index=True)
+    total_pages = Column(Integer, default=0)
+    finished_pages = Column(Integer, default=0)
+    claimed_by = Column(String(STR_LEN), default=None)
+    heartbeat_at = Column(DateTime, default=None)
+    attempts = Column(Integer, default=0)
+    queued_at = Column(DateTime)
+    started_at = Column(DateTime, default=None)
+    finished_at = Column(DateTime, default=None)
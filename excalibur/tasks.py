@@ -1,150 +1,678 @@
 import datetime as dt
-import glob
+import functools
 import json
 import logging
 import os
-import subprocess
+from collections import deque
+from contextlib import ExitStack
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 
-import camelot
-import pandas as pd
-from camelot.backends.pdfium_backend import PdfiumBackend
-from camelot.core import TableList
-from camelot.parsers import Lattice, Stream
+from sqlalchemy import func
 
 from . import configuration as conf
-from .models import File, Job, Rule
+from .models import Batch, File, FilePage, Job, Page, Result, Rule, Task, TaskState
 from .settings import Session
-from .utils.file import mkdirs
-from .utils.task import get_file_dim, get_image_dim, get_pages, save_page
+from .utils.database import upsert
+from .utils.export import (
+    RESULT_CACHE_DIRNAME,
+    RESULT_FILENAME,
+    ResultWriter,
+    get_result_key,
+)
+from .utils.file import evict_files, link_file, mkdirs
+from .utils.metadata import generate_uuid
+from .utils.render import close_document, open_document, render_images
+from .utils.scheduler import get_scheduler
+from .utils.task import (
+    detect_areas,
+    fix_rotation,
+    get_concurrency,
+    get_file_dim,
+    get_pages,
+    read_pdf,
+    save_pages,
+)
+
+
+def _start_task(session, task_name, target_id):
+    # marks the latest queued or claimed task on the target as running and
+    # returns its id. a task that was not sent through an executor gets
+    # one here.
+    task = (
+        session.query(Task)
+        .filter(
+            Task.task_name == task_name,
+            Task.target_id == target_id,
+            Task.state.in_((TaskState.QUEUED, TaskState.CLAIMED)),
+        )
+        .order_by(Task.queued_at.desc())
+        .first()
+    )
+    now = dt.datetime.now()
+    if task is None:
+        task = Task(
+            task_id=generate_uuid(),
+            task_name=task_name,
+            target_id=target_id,
+            queued_at=now,
+        )
+        session.add(task)
+    task.state = TaskState.RUNNING
+    task.started_at = now
+    task.total_pages = 0
+    task.finished_pages = 0
+    session.commit()
+    return task.task_id
+
+
+def _update_task(session, task_id, total_pages=0, finished_pages=0):
+    # adds to the page counters of a task with the next commit. the
+    # counters are incremented in the database, so that processes which
+    # work on the same task in parallel do not overwrite each other.
+    if task_id is None:
+        return
+    session.query(Task).filter(Task.task_id == task_id).update(
+        {
+            Task.total_pages: Task.total_pages + total_pages,
+            Task.finished_pages: Task.finished_pages + finished_pages,
+        }
+    )
+
+
+def _end_task(session, task_id, state):
+    # whatever a failed task left uncommitted is discarded
+    session.rollback()
+    session.query(Task).filter(Task.task_id == task_id).update(
+        {Task.state: state, Task.finished_at: dt.datetime.now()}
+    )
+    session.commit()
+
+
+def _render_page(filepath, page):
+    # fix rotated PDF
+    rotation = fix_rotation(filepath)
+
+    # render page from the source PDF
+    imagepath, thumbnailpath, imagedims = render_images(filepath, page, rotation)
+
+    return {
+        "filenames": os.path.basename(filepath),
+        "filepaths": filepath,
+        "imagenames": os.path.basename(imagepath),
+        "imagepaths": imagepath,
+        "thumbnailpaths": thumbnailpath,
+        "filedims": get_file_dim(filepath),
+        "imagedims": imagedims,
+    }
+
+
+def _detect_page(filepath):
+    # lattice and stream share one parse of the page
+    return detect_areas(filepath)
+
+
+def _split_page(filepath, page):
+    result = _render_page(filepath, page)
+    result["detected_areas"] = _detect_page(filepath)
+    return result
+
+
+def _extract_page(filepath, kwargs):
+    tables = read_pdf(filepath, **kwargs)
+    for table in tables:
+        # the page image is only needed to plot a table, and would
+        # otherwise be copied back from every worker process
+        table._image = None
+    return tables
+
+
+def _map_pages(func, pagepaths, pages, concurrency, initializer=None, initargs=()):
+    # yields results in page order, as soon as each one is ready
+    scheduler = get_scheduler()
+    if scheduler is not None:
+        # the pages take turns with those of the other tasks running in
+        # this process, in the pool that they share
+        key = object()
+        running = deque()
+        for pagepath, page in zip(pagepaths, pages):
+            if len(running) >= 2 * scheduler.concurrency:
+                yield running.popleft().result()
+            running.append(
+                scheduler.submit(
+                    key,
+                    func,
+                    pagepath,
+                    page,
+                    initializer=initializer,
+                    initargs=initargs,
+                )
+            )
+        while running:
+            yield running.popleft().result()
+    elif concurrency > 1:
+        with ProcessPoolExecutor(
+            concurrency, initializer=initializer, initargs=initargs
+        ) as pool:
+            # only keep a few pages in flight, so that results which are
+            # ready early do not pile up in memory behind a slow page
+            running = deque()
+            for pagepath, page in zip(pagepaths, pages):
+                if len(running) >= 2 * concurrency:
+                    yield running.popleft().result()
+                running.append(pool.submit(func, pagepath, page))
+            while running:
+                yield running.popleft().result()
+    else:
+        if initializer is not None:
+            initializer(*initargs)
+        yield from map(func, pagepaths, pages)
+
+
+def _next_page(session, file, pending):
+    # pages that are open in the workspace jump the queue
+    session.refresh(file, ["requested_pages"])
+    for page in json.loads(file.requested_pages or "[]"):
+        if page in pending:
+            return page
+    return pending[0]
+
+
+def _detect_pages(session, file, pagepaths, concurrency):
+    # yields (page, detected_areas) in priority order
+    pending = sorted(pagepaths)
+    scheduler = get_scheduler()
+    if scheduler is None and concurrency <= 1:
+        while pending:
+            page = _next_page(session, file, pending)
+            pending.remove(page)
+            yield page, _detect_page(pagepaths[page])
+        return
+
+    with ExitStack() as stack:
+        if scheduler is None:
+            submit = stack.enter_context(ProcessPoolExecutor(concurrency)).submit
+        else:
+            submit = functools.partial(scheduler.submit, object())
+            concurrency = scheduler.concurrency
+        running = {}
+        while pending or running:
+            while pending and len(running) < concurrency:
+                page = _next_page(session, file, pending)
+                pending.remove(page)
+                running[submit(_detect_page, pagepaths[page])] = page
+            done, __ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield running.pop(future), future.result()
+
+
+def _index_page(session, file, page, result):
+    # remember a finished page so that later uploads of the same
+    # content can reuse it instead of splitting it again
+    if file.file_hash is None:
+        return
+    upsert(
+        session,
+        Page(
+            file_hash=file.file_hash,
+            page=page,
+            filepath=result["filepaths"],
+            imagepath=result["imagepaths"],
+            thumbnailpath=result["thumbnailpaths"],
+            filedims=json.dumps(result["filedims"]),
+            imagedims=json.dumps(result["imagedims"]),
+            detected_areas=json.dumps(result["detected_areas"]),
+        ),
+    )
+
+
+def _get_page_result(row):
+    # returns a split result as it was stored in a Page or FilePage row
+    return {
+        "filenames": os.path.basename(row.filepath),
+        "filepaths": row.filepath,
+        "imagenames": os.path.basename(row.imagepath),
+        "imagepaths": row.imagepath,
+        "thumbnailpaths": row.thumbnailpath,
+        "filedims": json.loads(row.filedims),
+        "imagedims": json.loads(row.imagedims),
+        "detected_areas": (
+            json.loads(row.detected_areas) if row.detected_areas is not None else None
+        ),
+    }
+
+
+def _get_indexed_pages(session, file, pages):
+    if file.file_hash is None:
+        return {}
+    indexed = session.query(Page).filter(
+        Page.file_hash == file.file_hash, Page.page.in_(pages)
+    )
+    return {
+        p.page: _get_page_result(p)
+        for p in indexed
+        if all(
+            os.path.isfile(path) for path in (p.filepath, p.imagepath, p.thumbnailpath)
+        )
+    }
+
+
+def _prepare_split(session, file):
+    # saves the single-page PDFs of the pages that were not split from an
+    # upload with the same content before, and returns
+    # (extract_pages, indexed, new_pages, outpaths)
+    extract_pages, total_pages = get_pages(file.filepath, file.pages)
+
+    # pages that were already split from an upload with the same
+    # content are reused as they are
+    indexed = _get_indexed_pages(session, file, extract_pages)
+    new_pages = [page for page in extract_pages if page not in indexed]
+
+    # extract into single-page PDFs
+    outpaths = save_pages(file.filepath, new_pages)
+
+    file.extract_pages = json.dumps(extract_pages)
+    file.total_pages = total_pages
+    session.commit()
+    return extract_pages, indexed, new_pages, outpaths
+
+
+def _store_page(session, file, page, result):
+    # stores the split result of a page in a row of its own, so that
+    # every page that finishes only writes itself. a page whose table
+    # areas are not detected yet has none.
+    if not file.has_image:
+        file.has_image = True
+    detected_areas = result.get("detected_areas")
+    upsert(
+        session,
+        FilePage(
+            file_id=file.file_id,
+            page=page,
+            filepath=result["filepaths"],
+            imagepath=result["imagepaths"],
+            thumbnailpath=result["thumbnailpaths"],
+            filedims=json.dumps(result["filedims"]),
+            imagedims=json.dumps(result["imagedims"]),
+            detected_areas=(
+                json.dumps(detected_areas) if detected_areas is not None else None
+            ),
+            updated_at=func.now(),
+        ),
+    )
+
+
+def _store_areas(session, file_id, page, detected_areas):
+    # adds the table areas of a page that was stored without them
+    session.query(FilePage).filter(
+        FilePage.file_id == file_id, FilePage.page == page
+    ).update(
+        {
+            FilePage.detected_areas: json.dumps(detected_areas),
+            FilePage.updated_at: func.now(),
+        },
+        synchronize_session=False,
+    )
+
+
+def get_file_pages(session, file_id, since=None, pages=None):
+    """Returns the split results that are stored for a file.
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.Session
+    file_id : str
+    since : datetime.datetime, optional (default: None)
+        Only return the pages that were stored or updated at or after
+        this time of the database's clock.
+    pages : list, optional (default: None)
+        Only return these pages.
+
+    Returns
+    -------
+    pages : dict
+        Split results by page, in page order.
+
+    """
+    query = session.query(FilePage).filter(FilePage.file_id == file_id)
+    if since is not None:
+        query = query.filter(FilePage.updated_at >= since)
+    if pages is not None:
+        query = query.filter(FilePage.page.in_(pages))
+    return {row.page: _get_page_result(row) for row in query.order_by(FilePage.page)}
 
 
 def split(file_id):
+    session = Session()
+    task_id = _start_task(session, "split", file_id)
     try:
-        session = Session()
         file = session.query(File).filter(File.file_id == file_id).first()
-        extract_pages, total_pages = get_pages(file.filepath, file.pages)
-
-        (
-            filenames,
-            filepaths,
-            imagenames,
-            imagepaths,
-            filedims,
-            imagedims,
-            detected_areas,
-        ) = ({} for i in range(7))
-        for page in extract_pages:
-            # extract into single-page PDF
-            save_page(file.filepath, page)
-
-            filename = f"page-{page}.pdf"
-            filepath = os.path.join(conf.PDFS_FOLDER, file_id, filename)
-            imagename = "".join([filename.replace(".pdf", ""), ".png"])
-            imagepath = os.path.join(conf.PDFS_FOLDER, file_id, imagename)
-
-            # convert single-page PDF to PNG
-            backend = PdfiumBackend()
-            backend.convert(filepath, imagepath, 300)
-
-            filenames[page] = filename
-            filepaths[page] = filepath
-            imagenames[page] = imagename
-            imagepaths[page] = imagepath
-            filedims[page] = get_file_dim(filepath)
-            imagedims[page] = get_image_dim(imagepath)
-
-            lattice_areas, stream_areas = (None for i in range(2))
-            # lattice
-            tables = camelot.read_pdf(filepath, flavor="lattice")
-            if len(tables):
-                lattice_areas = []
-                for table in tables:
-                    x1, y1, x2, y2 = table._bbox
-                    lattice_areas.append((x1, y2, x2, y1))
-            # stream
-            tables = camelot.read_pdf(filepath, flavor="stream")
-            if len(tables):
-                stream_areas = []
-                for table in tables:
-                    x1, y1, x2, y2 = table._bbox
-                    stream_areas.append((x1, y2, x2, y1))
-
-            detected_areas[page] = {"lattice": lattice_areas, "stream": stream_areas}
-
-        file.extract_pages = json.dumps(extract_pages)
-        file.total_pages = total_pages
-        file.has_image = True
-        file.filenames = json.dumps(filenames)
-        file.filepaths = json.dumps(filepaths)
-        file.imagenames = json.dumps(imagenames)
-        file.imagepaths = json.dumps(imagepaths)
-        file.filedims = json.dumps(filedims)
-        file.imagedims = json.dumps(imagedims)
-        file.detected_areas = json.dumps(detected_areas)
+        extract_pages, indexed, new_pages, outpaths = _prepare_split(session, file)
+
+        # in lazy mode, table areas are detected after every page is rendered
+        lazy = conf.get("core", "table_detection") == "lazy"
 
+        # every page is persisted as soon as it is ready so that the
+        # workspace can show it before the whole split finishes
+        pages = {page: indexed[page] for page in extract_pages if page in indexed}
+        for page, result in pages.items():
+            _store_page(session, file, page, result)
+        _update_task(
+            session, task_id, total_pages=len(extract_pages), finished_pages=len(pages)
+        )
         session.commit()
+
+        if new_pages:
+            concurrency = min(get_concurrency("split_concurrency"), len(new_pages))
+            pagepaths = [outpaths[page] for page in new_pages]
+            # every process renders its pages from one handle on the source PDF
+            results = _map_pages(
+                _render_page if lazy else _split_page,
+                pagepaths,
+                new_pages,
+                concurrency,
+                initializer=open_document,
+                initargs=(file.filepath,),
+            )
+            for page, result in zip(new_pages, results):
+                pages[page] = result
+                _store_page(session, file, page, result)
+                if not lazy:
+                    _index_page(session, file, page, result)
+                    _update_task(session, task_id, finished_pages=1)
+                session.commit()
+            close_document()
+
+            if lazy:
+                for page, areas in _detect_pages(session, file, outpaths, concurrency):
+                    pages[page]["detected_areas"] = areas
+                    _store_areas(session, file.file_id, page, areas)
+                    _index_page(session, file, page, pages[page])
+                    _update_task(session, task_id, finished_pages=1)
+                    session.commit()
+
+        _end_task(session, task_id, TaskState.SUCCEEDED)
         session.close()
     except Exception as e:
         logging.exception(e)
+        _end_task(session, task_id, TaskState.FAILED)
+
+
+def _get_page_kwargs(rule_options):
+    # returns the read_pdf kwargs of every page a rule applies to
+    rule_options = dict(rule_options)
+    flavor = rule_options.pop("flavor")
+    pages = rule_options.pop("pages")
+
+    page_kwargs = {}
+    for p in pages:
+        kwargs = dict(pages[p])
+        kwargs.update(rule_options)
+        kwargs["flavor"] = flavor.lower()
+        if flavor.lower() == "lattice":
+            kwargs.pop("columns", None)
+        page_kwargs[p] = kwargs
+    return page_kwargs
+
+
+def _get_result_cache():
+    # returns the result cache directory and its maximum size in bytes
+    max_size = int(conf.get("core", "result_cache_size")) * 1024 * 1024
+    return os.path.join(conf.EXCALIBUR_HOME, RESULT_CACHE_DIRNAME), max_size
+
+
+def _get_cached_result(session, key, resultpath):
+    # links a cached result into place and returns its tables, or None
+    # if there is no cached result for the key
+    cachedir, max_size = _get_result_cache()
+    if key is None or max_size <= 0:
+        return None
+    result = session.query(Result).filter(Result.result_key == key).first()
+    if result is None:
+        return None
+    cachepath = os.path.join(cachedir, f"{key}.parquet")
+    try:
+        os.utime(cachepath)
+        link_file(cachepath, resultpath)
+    except FileNotFoundError:
+        # the cached file is gone, so its row is stale
+        session.delete(result)
+        session.commit()
+        return None
+    return json.loads(result.render_files)
+
+
+def _cache_result(session, key, resultpath, tables):
+    cachedir, max_size = _get_result_cache()
+    if key is None or max_size <= 0:
+        return
+    mkdirs(cachedir)
+    link_file(resultpath, os.path.join(cachedir, f"{key}.parquet"))
+    upsert(
+        session,
+        Result(
+            result_key=key,
+            render_files=json.dumps(tables),
+            created_at=dt.datetime.now(),
+        ),
+    )
+    removed = evict_files(cachedir, max_size, ".parquet")
+    if removed:
+        # the rows of the evicted results are deleted along with their files
+        keys = [os.path.splitext(os.path.basename(path))[0] for path in removed]
+        session.query(Result).filter(Result.result_key.in_(keys)).delete(
+            synchronize_session=False
+        )
+        session.commit()
+
+
+def _get_reusable_pages(session, job, file, page_kwargs):
+    # returns the result of the latest finished job on a file with the
+    # same content, and its tables on the pages it parsed with the same
+    # options as page_kwargs
+    query = (
+        session.query(Job)
+        .join(File, Job.file_id == File.file_id)
+        .filter(
+            Job.is_finished.is_(True),
+            Job.job_id != job.job_id,
+            Job.page_options.isnot(None),
+        )
+    )
+    if file.file_hash is not None:
+        query = query.filter(File.file_hash == file.file_hash)
+    else:
+        query = query.filter(Job.file_id == file.file_id)
+    previous = query.order_by(Job.finished_at.desc()).first()
+    if previous is None:
+        return None, {}
+    resultpath = os.path.join(previous.datapath, RESULT_FILENAME)
+    if not os.path.isfile(resultpath):
+        return None, {}
+
+    page_options = json.loads(previous.page_options)
+    reused = {
+        p: []
+        for p, kwargs in page_kwargs.items()
+        if p in page_options and page_options[p] == kwargs
+    }
+    for table in json.loads(previous.render_files).values():
+        if str(table["page"]) in reused:
+            reused[str(table["page"])].append(table)
+    return resultpath, reused
+
+
+def _plan_job(session, job, file, rule_options, page_kwargs):
+    # returns how a job's result is built, as a dict that can be passed
+    # between processes: taken from the result cache, copied from an
+    # earlier job on the file, or parsed page by page
+    datapath = os.path.join(os.path.dirname(file.filepath), job.job_id)
+    mkdirs(datapath)
+    # the job's tables are stored in one parquet file, which is the
+    # canonical result that the job page and the downloadable formats
+    # are built from
+    resultpath = os.path.join(datapath, RESULT_FILENAME)
+    filepaths = {
+        str(page): result["filepaths"]
+        for page, result in get_file_pages(session, file.file_id).items()
+    }
+    # a page that was not split would silently be missing from the result
+    missing = [p for p in page_kwargs if p not in filepaths]
+    if missing:
+        raise ValueError(
+            f"Pages {', '.join(missing)} were not split from {file.filename}"
+        )
+    pages = list(page_kwargs)
+
+    # a file with the same content that was extracted with the same
+    # rule options before is not parsed again
+    key = None
+    if file.file_hash is not None:
+        key = get_result_key(file.file_hash, rule_options, pages)
+    tables = _get_cached_result(session, key, resultpath)
+
+    # otherwise only the pages whose options changed since the last
+    # job on the file are parsed again
+    previouspath, reused, units = None, {}, []
+    if tables is None:
+        previouspath, reused = _get_reusable_pages(session, job, file, page_kwargs)
+        units = [(p, filepaths[p]) for p in pages if p not in reused]
+    return {
+        "datapath": datapath,
+        "pages": pages,
+        "key": key,
+        "tables": tables,
+        "previouspath": previouspath,
+        "reused": reused,
+        "units": units,
+    }
+
+
+def _write_page(writer, page, tables):
+    # writes the tables parsed from a page and returns their entries
+    entries = []
+    for table in tables:
+        table.page = int(page)
+        entries.append(
+            {"page": table.page, "table": table.order, "shape": list(table.df.shape)}
+        )
+    writer.write(tables)
+    return entries
+
+
+def _finish_job(session, job, file, plan, page_kwargs, write_page, task_id=None):
+    # writes the job's result, calling write_page(writer, page) for every
+    # page that is parsed, and marks the job as finished. every page is
+    # counted on the task as soon as it is written.
+    resultpath = os.path.join(plan["datapath"], RESULT_FILENAME)
+    tables = plan["tables"]
+    if tables is None:
+        # every page's tables are written as soon as they are parsed
+        # and then dropped, so that memory use does not grow with the job
+        tables = []
+        with ResultWriter(resultpath) as writer:
+            for p in plan["pages"]:
+                if p in plan["reused"]:
+                    writer.copy_page(plan["previouspath"], int(p))
+                    tables.extend(plan["reused"][p])
+                else:
+                    tables.extend(write_page(writer, p))
+                if task_id is not None:
+                    _update_task(session, task_id, finished_pages=1)
+                    session.commit()
+        _cache_result(session, plan["key"], resultpath, tables)
+    else:
+        _update_task(session, task_id, finished_pages=len(plan["pages"]))
+
+    froot, fext = os.path.splitext(file.filename)
+    render_files = {}
+    for table in tables:
+        name = f"{froot}-page-{table['page']}-table-{table['table']}"
+        render_files[name] = table
+
+    job.datapath = plan["datapath"]
+    job.render_files = json.dumps(render_files)
+    job.page_options = json.dumps({p: page_kwargs[p] for p in plan["pages"]})
+    job.is_finished = True
+    job.finished_at = dt.datetime.now()
+    session.commit()
+
+
+def _extract_jobs(session, jobs, rule_options, task_id=None):
+    # extracts tables for (job, file) pairs that share one rule, yielding
+    # every job as soon as it is finished. the pages of all files go
+    # through one process pool, so that it stays busy across files.
+    page_kwargs = _get_page_kwargs(rule_options)
+    plans = [
+        _plan_job(session, job, file, rule_options, page_kwargs) for job, file in jobs
+    ]
+    _update_task(
+        session, task_id, total_pages=sum(len(plan["pages"]) for plan in plans)
+    )
+    session.commit()
+    units = [unit for plan in plans for unit in plan["units"]]
+
+    concurrency = min(get_concurrency("extract_concurrency"), len(units))
+    results = _map_pages(
+        _extract_page,
+        [pagepath for p, pagepath in units],
+        [page_kwargs[p] for p, pagepath in units],
+        concurrency,
+    )
+
+    def write_page(writer, page):
+        return _write_page(writer, page, next(results))
+
+    for (job, file), plan in zip(jobs, plans):
+        _finish_job(session, job, file, plan, page_kwargs, write_page, task_id)
+        yield job
 
 
 def extract(job_id):
+    session = Session()
+    task_id = _start_task(session, "extract", job_id)
     try:
-        session = Session()
         job = session.query(Job).filter(Job.job_id == job_id).first()
         rule = session.query(Rule).filter(Rule.rule_id == job.rule_id).first()
         file = session.query(File).filter(File.file_id == job.file_id).first()
 
         rule_options = json.loads(rule.rule_options)
-        flavor = rule_options.pop("flavor")
-        pages = rule_options.pop("pages")
+        for job in _extract_jobs(session, [(job, file)], rule_options, task_id):
+            pass
+
+        _end_task(session, task_id, TaskState.SUCCEEDED)
+        session.close()
+    except Exception as e:
+        logging.exception(e)
+        _end_task(session, task_id, TaskState.FAILED)
 
-        tables = []
-        filepaths = json.loads(file.filepaths)
-        for p in pages:
-            kwargs = pages[p]
-            kwargs.update(rule_options)
-            kwargs["flavor"] = flavor.lower()
-            if flavor.lower() == "lattice":
-                kwargs.pop("columns", None)
-
-            t = camelot.read_pdf(filepaths[p], **kwargs)
-            for _t in t:
-                _t.page = int(p)
-            tables.extend(t)
-        tables = TableList(tables)
-
-        froot, fext = os.path.splitext(file.filename)
-        datapath = os.path.dirname(file.filepath)
-        for f in ["csv", "excel", "json", "html"]:
-            f_datapath = os.path.join(datapath, f)
-            mkdirs(f_datapath)
-            ext = f if f != "excel" else "xlsx"
-            f_datapath = os.path.join(f_datapath, f"{froot}.{ext}")
-
-            if f == "excel":
-                with pd.ExcelWriter(f_datapath) as writer:
-                    for i, table in enumerate(tables):
-                        sheet_name = f"Table_{i + 1}"
-                        table.df.to_excel(writer, sheet_name=sheet_name, index=False)
-            else:
-                tables.export(f_datapath, f=f, compress=True)
-
-        # for render
-        jsonpath = os.path.join(datapath, "json")
-        jsonpath = os.path.join(jsonpath, f"{froot}.json")
-        tables.export(jsonpath, f="json")
-        render_files = {
-            os.path.splitext(os.path.basename(f))[0]: f
-            for f in glob.glob(os.path.join(datapath, "json/*.json"))
-        }
 
-        job.datapath = datapath
-        job.render_files = json.dumps(render_files)
-        job.is_finished = True
-        job.finished_at = dt.datetime.now()
+def extract_batch(batch_id):
+    session = Session()
+    task_id = _start_task(session, "extract_batch", batch_id)
+    try:
+        batch = session.query(Batch).filter(Batch.batch_id == batch_id).first()
+        rule = session.query(Rule).filter(Rule.rule_id == batch.rule_id).first()
+        jobs = []
+        for file_id in json.loads(batch.file_ids):
+            job = (
+                session.query(Job)
+                .filter(Job.batch_id == batch_id, Job.file_id == file_id)
+                .first()
+            )
+            file = session.query(File).filter(File.file_id == file_id).first()
+            jobs.append((job, file))
+
+        # the rule is parsed once for all files of the batch
+        rule_options = json.loads(rule.rule_options)
+        for job in _extract_jobs(session, jobs, rule_options, task_id):
+            batch.finished_jobs += 1
+            session.commit()
 
+        batch.is_finished = True
+        batch.finished_at = dt.datetime.now()
         session.commit()
+        _end_task(session, task_id, TaskState.SUCCEEDED)
         session.close()
     except Exception as e:
         logging.exception(e)
+        _end_task(session, task_id, TaskState.FAILED)
@@ -1,5 +1,10 @@
+from sqlalchemy import inspect
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
 from ..settings import engine
 
+UPSERT_DIALECTS = {"postgresql": postgresql, "sqlite": sqlite}
+
 
 def initialize_database():
     from ..models import Base
@@ -12,3 +17,38 @@ def reset_database():
 
     Base.metadata.drop_all(engine)
     initialize_database()
+
+
+def upsert(session, row):
+    """Inserts a row, or updates the row with the same primary key.
+
+    Unlike session.merge, which looks the row up before inserting it,
+    this is one statement, so that two tasks which store the same row at
+    the same time do not fail on the primary key.
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.Session
+    row : excalibur.models.Base
+        Model instance with every column that is stored set.
+
+    """
+    mapper = inspect(type(row))
+    values = {
+        column.key: getattr(row, column.key)
+        for column in mapper.columns
+        if getattr(row, column.key) is not None
+    }
+    keys = [column.key for column in mapper.primary_key]
+    updates = {key: value for key, value in values.items() if key not in keys}
+    dialect = session.get_bind().dialect.name
+    if dialect in UPSERT_DIALECTS:
+        statement = UPSERT_DIALECTS[dialect].insert(mapper.local_table).values(values)
+        statement = statement.on_conflict_do_update(index_elements=keys, set_=updates)
+    elif dialect == "mysql":
+        statement = mysql.insert(mapper.local_table).values(values)
+        statement = statement.on_duplicate_key_update(updates)
+    else:
+        session.merge(row)
+        return
+    session.execute(statement)
@@ -0,0 +1,410 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+
+import camelot
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from openpyxl import Workbook
+
+from .. import configuration as conf
+
+EXPORT_FORMATS = {"csv": ".csv", "excel": ".xlsx", "json": ".json", "html": ".html"}
+RESULT_FILENAME = "result.parquet"
+RESULT_CACHE_DIRNAME = "results"
+# every cell of every table of a job is one row, tables are stored as
+# dense grids in row-major order so that they can be reshaped back
+RESULT_SCHEMA = pa.schema(
+    [
+        ("page", pa.int32()),
+        ("table", pa.int32()),
+        ("row", pa.int32()),
+        ("column", pa.int32()),
+        ("text", pa.string()),
+    ]
+)
+# the most rows an Excel worksheet can hold, header included
+EXCEL_SHEET_ROWS = 1048576
+# the number of rows read from the result at a time when writing a sheet
+EXCEL_CHUNK_ROWS = 10000
+
+
+class ResultWriter:
+    """Writes a job's tables to its canonical result, a Parquet file
+    with one row per cell keyed by page, table, row and column.
+
+    Tables are appended page by page and are not kept in memory.
+
+    Parameters
+    ----------
+    resultpath : str
+        Path to the Parquet file.
+
+    """
+
+    def __init__(self, resultpath):
+        self.writer = pq.ParquetWriter(resultpath, RESULT_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, tables):
+        """Appends tables to the result.
+
+        Parameters
+        ----------
+        tables : camelot.core.TableList
+            Tables with their page and order set.
+
+        """
+        columns = {name: [] for name in RESULT_SCHEMA.names}
+        for table in tables:
+            nrows, ncols = table.df.shape
+            columns["page"].append(np.full(nrows * ncols, table.page))
+            columns["table"].append(np.full(nrows * ncols, table.order))
+            columns["row"].append(np.repeat(np.arange(nrows), ncols))
+            columns["column"].append(np.tile(np.arange(ncols), nrows))
+            columns["text"].append(table.df.to_numpy().ravel())
+        if not columns["text"]:
+            return
+        arrays = [
+            pa.array(np.concatenate(columns[field.name]), type=field.type)
+            for field in RESULT_SCHEMA
+        ]
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=RESULT_SCHEMA))
+
+    def copy_page(self, resultpath, page):
+        """Appends the tables of a page from another job's result.
+
+        Parameters
+        ----------
+        resultpath : str
+            Path to the other job's Parquet result.
+        page : int
+
+        """
+        tables = pq.read_table(
+            resultpath, filters=[("page", "=", page)], schema=RESULT_SCHEMA
+        )
+        if tables.num_rows:
+            self.writer.write_table(tables)
+
+    def close(self):
+        self.writer.close()
+
+
+def read_table(resultpath, table, rows=None, columns=None):
+    """Reads a table of a job's canonical result into a DataFrame.
+
+    Only the cells of the table are read, and the read can be limited
+    further to a range of rows and a list of columns.
+
+    Parameters
+    ----------
+    resultpath : str
+        Path to the job's Parquet result.
+    table : dict
+        The table's entry in the job's render_files, with its 'page',
+        'table' (order on the page) and 'shape'.
+    rows : tuple, optional (default: None)
+        Range of rows to read in the form (start, stop).
+    columns : list, optional (default: None)
+        Columns to read.
+
+    Returns
+    -------
+    df : pandas.DataFrame
+
+    """
+    nrows, ncols = table["shape"]
+    filters = [("page", "=", table["page"]), ("table", "=", table["table"])]
+    if rows is not None:
+        start, stop = max(rows[0], 0), min(rows[1], nrows)
+        filters.extend([("row", ">=", start), ("row", "<", stop)])
+    if columns is not None:
+        columns = sorted(c for c in set(columns) if 0 <= c < ncols)
+        filters.append(("column", "in", columns))
+    else:
+        columns = list(range(ncols))
+    if not columns:
+        return pd.DataFrame()
+
+    text = pq.read_table(resultpath, columns=["text"], filters=filters)["text"]
+    values = text.to_numpy(zero_copy_only=False)
+    return pd.DataFrame(values.reshape(-1, len(columns)), columns=columns)
+
+
+def get_result_key(file_hash, rule_options, pages):
+    """Returns the key under which the result of applying a rule to a
+    file is cached.
+
+    The key is a hash of the file's content hash, the rule options
+    serialized with sorted keys, the pages that are extracted and the
+    camelot version.
+
+    Parameters
+    ----------
+    file_hash : str
+        sha256 hash of the file's content.
+    rule_options : dict
+    pages : list
+        Pages of the file that the rule is applied to. A rule can cover
+        pages that were not split from an upload, which are skipped.
+
+    Returns
+    -------
+    key : str
+
+    """
+    h = hashlib.sha256()
+    h.update(file_hash.encode("utf-8"))
+    h.update(json.dumps(rule_options, sort_keys=True, separators=(",", ":")).encode())
+    h.update(json.dumps(sorted(int(page) for page in pages)).encode())
+    h.update(camelot.__version__.encode("utf-8"))
+    return h.hexdigest()
+
+
+def write_table(df, path, f):
+    """Writes a table the way camelot's export writes it.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+    path : str
+        Output filepath.
+    f : str
+        File format. Can be csv, json or html.
+
+    """
+    if f == "csv":
+        df.to_csv(path, encoding="utf-8", index=False, header=False, quoting=1)
+    elif f == "json":
+        with open(path, "w") as fp:
+            fp.write(df.to_json(orient="records"))
+    elif f == "html":
+        with open(path, "w", encoding="utf-8") as fp:
+            fp.write(df.to_html())
+    else:
+        raise NotImplementedError(f"Unknown format specified: {f}")
+
+
+class ExcelWriter:
+    """Writes tables to one or more write-only Excel workbooks.
+
+    Rows are streamed from a job's canonical result straight into the
+    sheets, so memory use does not grow with the size of the tables. A
+    table with more rows than a sheet can hold is continued on the next
+    sheets, and a new workbook is started whenever the current one would
+    exceed the [webserver] excel_max_sheets or excel_max_rows.
+
+    Parameters
+    ----------
+    path : str
+        Path to the first workbook. The other workbooks are saved next
+        to it with a number appended to its name.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.max_sheets = max(int(conf.get("webserver", "excel_max_sheets")), 1)
+        self.max_rows = max(int(conf.get("webserver", "excel_max_rows")), 2)
+        self.paths = []
+        self.workbook = None
+
+    def _add_sheet(self, title, nrows):
+        if self.workbook is not None and (
+            self.sheets >= self.max_sheets or self.rows + nrows > self.max_rows
+        ):
+            self._save()
+        if self.workbook is None:
+            self.workbook = Workbook(write_only=True)
+            self.sheets, self.rows = 0, 0
+        self.sheets += 1
+        self.rows += nrows
+        return self.workbook.create_sheet(title)
+
+    def _save(self):
+        froot, ext = os.path.splitext(self.path)
+        path = self.path if not self.paths else f"{froot}-{len(self.paths) + 1}{ext}"
+        self.workbook.save(path)
+        self.paths.append(path)
+        self.workbook = None
+
+    def write(self, resultpath, table, title):
+        """Writes a table to new sheets, with its column numbers as header.
+
+        Parameters
+        ----------
+        resultpath : str
+            Path to the job's Parquet result.
+        table : dict
+            The table's entry in the job's render_files.
+        title : str
+            Sheet name. Continuation sheets get a number appended to it.
+
+        """
+        nrows, ncols = table["shape"]
+        sheet_rows = min(EXCEL_SHEET_ROWS, self.max_rows) - 1
+        start, part = 0, 1
+        while True:
+            stop = min(start + sheet_rows, nrows)
+            name = title if part == 1 else f"{title}_{part}"
+            worksheet = self._add_sheet(name, stop - start + 1)
+            worksheet.append(range(ncols))
+            for chunk in range(start, stop, EXCEL_CHUNK_ROWS):
+                rows = (chunk, min(chunk + EXCEL_CHUNK_ROWS, stop))
+                for row in read_table(resultpath, table, rows=rows).itertuples(
+                    index=False
+                ):
+                    worksheet.append(row)
+            start, part = stop, part + 1
+            if start >= nrows:
+                break
+
+    def close(self):
+        """Saves the last workbook.
+
+        Returns
+        -------
+        paths : list
+            Paths to the workbooks, in order.
+
+        """
+        if self.workbook is not None:
+            self._save()
+        return self.paths
+
+
+def get_export(datapath, froot, render_files, f):
+    """Returns the export of a job's tables in the given format.
+
+    The export is built from the job's canonical result the first time
+    it is requested, and cached in the job's data directory after that.
+    Excel exports are a workbook with one sheet per table, or a zip
+    archive of workbooks if the tables do not fit in one. The other
+    formats are a zip archive with one file per table.
+
+    Parameters
+    ----------
+    datapath : str
+        Path to the job's data directory.
+    froot : str
+        Name of the extracted file without its extension.
+    render_files : dict
+        Maps table names to their entries in the job's canonical result,
+        in extraction order.
+    f : str
+        File format. Can be csv, excel, json or html.
+
+    Returns
+    -------
+    exportpath : str
+        Path to the export.
+
+    """
+    f = f.lower()
+    if f not in EXPORT_FORMATS:
+        raise NotImplementedError(f"Unknown format specified: {f}")
+
+    exportdir = os.path.join(datapath, f)
+    exportpath = os.path.join(exportdir, f"{froot}.zip")
+    if f == "excel":
+        bookpath = os.path.join(exportdir, f"{froot}{EXPORT_FORMATS[f]}")
+        if os.path.isfile(bookpath):
+            return bookpath
+    if os.path.isfile(exportpath):
+        return exportpath
+
+    # build the export in a temporary directory and move it into place,
+    # so that concurrent downloads never serve a partially written file
+    resultpath = os.path.join(datapath, RESULT_FILENAME)
+    os.makedirs(exportdir, exist_ok=True)
+    tempdir = tempfile.mkdtemp(dir=exportdir)
+    try:
+        temppath = os.path.join(tempdir, os.path.basename(exportpath))
+        if f == "excel":
+            writer = ExcelWriter(os.path.join(tempdir, os.path.basename(bookpath)))
+            for i, table in enumerate(render_files.values()):
+                writer.write(resultpath, table, f"Table_{i + 1}")
+            bookpaths = writer.close()
+            if len(bookpaths) == 1:
+                temppath, exportpath = bookpaths[0], bookpath
+            else:
+                with zipfile.ZipFile(temppath, "w", allowZip64=True) as z:
+                    for path in bookpaths:
+                        z.write(path, os.path.basename(path))
+        else:
+            with zipfile.ZipFile(temppath, "w", allowZip64=True) as z:
+                for name, table in render_files.items():
+                    arcname = f"{name}{EXPORT_FORMATS[f]}"
+                    tablepath = os.path.join(tempdir, arcname)
+                    write_table(read_table(resultpath, table), tablepath, f)
+                    z.write(tablepath, arcname)
+                    os.remove(tablepath)
+        os.replace(temppath, exportpath)
+    finally:
+        shutil.rmtree(tempdir, ignore_errors=True)
+    return exportpath
+
+
+def get_batch_export(datapath, name, exports, f):
+    """Returns the combined export of a batch's jobs in the given format.
+
+    The combined export is a zip archive of every job's export, built
+    the first time it is requested and cached after that.
+
+    Parameters
+    ----------
+    datapath : str
+        Path to the batch's data directory.
+    name : str
+        Name of the combined export without its extension.
+    exports : list
+        Tuples of the form (froot, exportpath) of every job's export, as
+        returned by get_export.
+    f : str
+        File format. Can be csv, excel, json or html.
+
+    Returns
+    -------
+    exportpath : str
+        Path to the combined export.
+
+    """
+    f = f.lower()
+    if f not in EXPORT_FORMATS:
+        raise NotImplementedError(f"Unknown format specified: {f}")
+
+    exportdir = os.path.join(datapath, f)
+    exportpath = os.path.join(exportdir, f"{name}.zip")
+    if os.path.isfile(exportpath):
+        return exportpath
+
+    os.makedirs(exportdir, exist_ok=True)
+    fd, temppath = tempfile.mkstemp(suffix=".tmp", dir=exportdir)
+    os.close(fd)
+    try:
+        arcnames = set()
+        with zipfile.ZipFile(temppath, "w", allowZip64=True) as z:
+            for froot, jobexportpath in exports:
+                __, ext = os.path.splitext(jobexportpath)
+                # files with the same name get a number appended
+                arcname, i = f"{froot}{ext}", 1
+                while arcname in arcnames:
+                    arcname, i = f"{froot}-{i}{ext}", i + 1
+                arcnames.add(arcname)
+                z.write(jobexportpath, arcname)
+        os.replace(temppath, exportpath)
+    finally:
+        if os.path.exists(temppath):
+            os.remove(temppath)
+    return exportpath
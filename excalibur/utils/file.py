@@ -1,4 +1,7 @@
+import hashlib
 import os
+import shutil
+import tempfile
 
 from .. import configuration as conf
 
@@ -13,3 +16,74 @@ def allowed_filename(filename):
         "." in filename
         and filename.rsplit(".", 1)[1].lower() in conf.ALLOWED_EXTENSIONS
     )
+
+
+def save_and_hash(file, filepath):
+    """Saves an uploaded file and returns the sha256 hash of its content.
+
+    The hash is computed while the file is being written, so the upload
+    is only read once.
+    """
+    h = hashlib.sha256()
+    with open(filepath, "wb") as f:
+        for chunk in iter(lambda: file.stream.read(1024 * 1024), b""):
+            h.update(chunk)
+            f.write(chunk)
+    return h.hexdigest()
+
+
+def link_file(src, dst):
+    """Hard links a file to a new path, or copies it if it cannot be linked.
+
+    The new path is replaced atomically if it already exists.
+    """
+    fd, temppath = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(dst))
+    os.close(fd)
+    os.remove(temppath)
+    try:
+        os.link(src, temppath)
+    except OSError:
+        shutil.copyfile(src, temppath)
+    os.replace(temppath, dst)
+
+
+def evict_files(cachedir, max_size, ext):
+    """Removes least recently used files until a cache fits in max_size.
+
+    Parameters
+    ----------
+    cachedir : str
+        Path to cache directory.
+    max_size : int
+        Maximum cache size in bytes.
+    ext : str
+        Extension of the cached files.
+
+    Returns
+    -------
+    removed : list
+        Paths of the files that were removed.
+
+    """
+    entries = []
+    for entry in os.scandir(cachedir):
+        if not entry.name.endswith(ext):
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    size = sum(entry[1] for entry in entries)
+    removed = []
+    for mtime, entry_size, path in sorted(entries):
+        if size <= max_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        removed.append(path)
+        size -= entry_size
+    return removed
@@ -0,0 +1,96 @@
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import tempfile
+
+from camelot.utils import get_page_layout as _get_page_layout
+
+from .. import configuration as conf
+from .file import evict_files
+
+LAYOUT_CACHE_DIRNAME = "layouts"
+LAYOUT_DEFAULTS = {
+    name: parameter.default
+    for name, parameter in inspect.signature(_get_page_layout).parameters.items()
+    if parameter.default is not inspect.Parameter.empty
+}
+
+
+def get_layout_key(filename, **layout_kwargs):
+    """Returns the cache key of a single page pdf's layout.
+
+    The key is a hash of the pdf's content and the layout parameters,
+    with unspecified parameters filled in from their defaults.
+
+    Parameters
+    ----------
+    filename : str
+        Path to pdf file.
+    layout_kwargs : dict
+        See camelot.utils.get_page_layout kwargs.
+
+    Returns
+    -------
+    key : str
+
+    """
+    params = dict(LAYOUT_DEFAULTS, **layout_kwargs)
+    h = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    h.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+def get_page_layout(filename, **layout_kwargs):
+    """Returns a PDFMiner LTPage object and page dimension of a single page pdf.
+
+    Same as camelot.utils.get_page_layout, but the result is cached on
+    disk in a "layouts" directory next to the pdf, so that a page's layout
+    is only computed once for a given set of layout parameters. The cache
+    size is bounded by the [core] layout_cache_size option.
+
+    Parameters
+    ----------
+    filename : str
+        Path to pdf file.
+    layout_kwargs : dict
+        See camelot.utils.get_page_layout kwargs.
+
+    Returns
+    -------
+    layout : object
+        PDFMiner LTPage object.
+    dim : tuple
+        Dimension of pdf page in the form (width, height).
+
+    """
+    max_size = int(conf.get("core", "layout_cache_size")) * 1024 * 1024
+    if max_size <= 0:
+        return _get_page_layout(filename, **layout_kwargs)
+
+    cachedir = os.path.join(os.path.dirname(filename), LAYOUT_CACHE_DIRNAME)
+    key = get_layout_key(filename, **layout_kwargs)
+    cachepath = os.path.join(cachedir, f"{key}.pickle")
+    try:
+        with open(cachepath, "rb") as f:
+            layout, dim = pickle.load(f)
+        os.utime(cachepath)
+        return layout, dim
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
+
+    layout, dim = _get_page_layout(filename, **layout_kwargs)
+
+    # write to a temporary file first so that concurrent readers never
+    # see a partially written layout
+    os.makedirs(cachedir, exist_ok=True)
+    fd, temppath = tempfile.mkstemp(suffix=".tmp", dir=cachedir)
+    with os.fdopen(fd, "wb") as f:
+        pickle.dump((layout, dim), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temppath, cachepath)
+    evict_files(cachedir, max_size, ".pickle")
+    return layout, dim
@@ -0,0 +1,241 @@
+import atexit
+import collections
+import math
+import os
+import tempfile
+
+import pypdfium2 as pdfium
+from PIL import Image
+
+from .. import configuration as conf
+from .file import link_file
+
+IMAGE_FORMATS = {
+    "png": ("PNG", ".png", {}),
+    "jpeg": ("JPEG", ".jpg", {"quality": 85}),
+    "webp": ("WEBP", ".webp", {"quality": 85}),
+}
+# clockwise degrees that match the rotation fix_rotation applies
+ROTATIONS = {"": 0, "anticlockwise": 90, "clockwise": 270}
+# documents kept open per process, for workers that render the pages of
+# several uploads in turn
+MAX_OPEN_DOCUMENTS = 4
+
+_document = None
+_documents = collections.OrderedDict()
+
+
+def get_image_format():
+    """Returns the configured image format for page images.
+
+    Returns
+    -------
+    image_format : str
+        One of 'png', 'jpeg' or 'webp'.
+
+    """
+    image_format = conf.get("core", "image_format").lower()
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"Unknown image format: {image_format}")
+    return image_format
+
+
+def save_image(image, imagepath, image_format="png"):
+    """Saves a PIL image in the given format.
+
+    The image is written to a temporary file first and then moved into
+    place, so that the webserver never serves a partially written image.
+
+    Parameters
+    ----------
+    image : PIL.Image.Image
+    imagepath : str
+        Path where to save the image.
+    image_format : str, optional (default: 'png')
+        One of 'png', 'jpeg' or 'webp'.
+
+    """
+    pil_format, __, options = IMAGE_FORMATS[image_format]
+    if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    fd, temppath = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(imagepath))
+    with os.fdopen(fd, "wb") as f:
+        image.save(f, format=pil_format, **options)
+    # mkstemp creates files that only the owner can read
+    os.chmod(temppath, 0o644)
+    os.replace(temppath, imagepath)
+
+
+def render_page(filepath, resolution):
+    """Renders a single-page PDF to a PIL image.
+
+    Parameters
+    ----------
+    filepath : str
+        Path to single-page PDF file.
+    resolution : int
+        Resolution in DPI.
+
+    Returns
+    -------
+    image : PIL.Image.Image
+
+    """
+    doc = pdfium.PdfDocument(filepath)
+    try:
+        doc.init_forms()
+        return doc[0].render(scale=resolution / 72).to_pil()
+    finally:
+        doc.close()
+
+
+def open_document(filepath, password=None):
+    """Opens the PDF that render_images renders pages from.
+
+    Every page of an upload is rendered from the same pdfium handle. A
+    document that is still open is reused, and the last few documents are
+    kept open, so that a worker that renders the pages of several uploads
+    in turn does not parse each of them again for every page.
+
+    Parameters
+    ----------
+    filepath : str
+        Path to PDF file.
+    password : str, optional (default: None)
+        Password for decryption.
+
+    """
+    global _document
+
+    if filepath in _documents:
+        _documents.move_to_end(filepath)
+    else:
+        document = pdfium.PdfDocument(filepath, password=password)
+        document.init_forms()
+        _documents[filepath] = document
+        while len(_documents) > MAX_OPEN_DOCUMENTS:
+            __, oldest = _documents.popitem(last=False)
+            oldest.close()
+    _document = _documents[filepath]
+
+
+def close_document():
+    global _document
+
+    while _documents:
+        __, document = _documents.popitem()
+        document.close()
+    _document = None
+
+
+# documents that are still open when a worker exits are closed while
+# pdfium is still loaded
+atexit.register(close_document)
+
+
+def get_high_resolution_path(filepath):
+    """Returns the path of the high resolution PNG of a single-page PDF."""
+    resolution = int(conf.get("core", "high_resolution"))
+    froot, __ = os.path.splitext(filepath)
+    return f"{froot}-{resolution}dpi.png"
+
+
+def render_images(filepath, page_number, rotation=""):
+    """Renders the high resolution image, workspace image and thumbnail
+    of a page.
+
+    The page is rendered straight from the document opened with
+    open_document, once at the [core] high_resolution. That render is
+    kept as the page raster for lattice detection and zooming, and the
+    workspace image and thumbnail are scaled down from it.
+
+    Parameters
+    ----------
+    filepath : str
+        Path to the single-page PDF of the page. The images are saved
+        next to it.
+    page_number : int
+        Page number in the opened document.
+    rotation : str, optional (default: '')
+        '', 'clockwise' or 'anticlockwise', as returned by fix_rotation.
+
+    Returns
+    -------
+    imagepath : str
+        Path to the workspace image.
+    thumbnailpath : str
+        Path to the thumbnail.
+    imagedims : list
+        Dimension of the workspace image in the form [width, height].
+
+    """
+    image_format = get_image_format()
+    ext = IMAGE_FORMATS[image_format][1]
+    froot, __ = os.path.splitext(filepath)
+    imagepath = "".join([froot, ext])
+    thumbnailpath = "".join([froot, "-thumbnail", ext])
+
+    high_resolution = int(conf.get("core", "high_resolution"))
+    page = _document[page_number - 1]
+    try:
+        image = page.render(
+            scale=high_resolution / 72, rotation=ROTATIONS[rotation]
+        ).to_pil()
+    finally:
+        page.close()
+    save_image(image, get_high_resolution_path(filepath))
+
+    resolution = int(conf.get("core", "image_resolution"))
+    if high_resolution % resolution == 0:
+        image = image.reduce(high_resolution // resolution)
+    else:
+        # round up like pdfium does when rendering at a given scale
+        image = image.resize(
+            (
+                math.ceil(image.width * resolution / high_resolution),
+                math.ceil(image.height * resolution / high_resolution),
+            ),
+            Image.LANCZOS,
+        )
+    save_image(image, imagepath, image_format=image_format)
+    imagedims = list(image.size)
+
+    thumbnail_width = int(conf.get("core", "thumbnail_width"))
+    image.thumbnail((thumbnail_width, thumbnail_width * image.height // image.width))
+    save_image(image, thumbnailpath, image_format=image_format)
+
+    return imagepath, thumbnailpath, imagedims
+
+
+def render_high_resolution(filepath):
+    """Returns a high resolution PNG of a single-page PDF.
+
+    The PNG is normally saved by render_images during split, it is
+    rendered at the [core] high_resolution here if it is missing.
+
+    Parameters
+    ----------
+    filepath : str
+        Path to single-page PDF file.
+
+    Returns
+    -------
+    imagepath : str
+        Path to the high resolution PNG.
+
+    """
+    resolution = int(conf.get("core", "high_resolution"))
+    imagepath = get_high_resolution_path(filepath)
+    if not os.path.isfile(imagepath):
+        save_image(render_page(filepath, resolution), imagepath)
+    return imagepath
+
+
+class RenderedPageBackend:
+    """Image conversion backend for camelot's lattice parser that reuses
+    the high resolution PNG of a single-page PDF instead of rasterising
+    the page again.
+    """
+
+    def convert(self, pdf_path, png_path):
+        link_file(render_high_resolution(pdf_path), png_path)
@@ -0,0 +1,174 @@
+import collections
+import functools
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# a unit that was running when a pool process died is run once more, and
+# fails if the pool breaks again while it runs
+MAX_ATTEMPTS = 2
+
+_scheduler = None
+
+
+def _run_unit(initializer, initargs, func, args):
+    if initializer is not None:
+        initializer(*initargs)
+    return func(*args)
+
+
+class _Unit:
+    def __init__(self, key, future, func, args, initializer, initargs):
+        self.key = key
+        self.future = future
+        self.func = func
+        self.args = args
+        self.initializer = initializer
+        self.initargs = initargs
+        self.attempts = 0
+
+
+class PageScheduler:
+    """Runs the page-sized units of work of concurrent tasks in one
+    shared process pool.
+
+    Units are queued per task, and whenever a pool worker is free it
+    takes the next unit from the task whose turn it is, round-robin. A
+    task with a few pages therefore finishes quickly even while a task
+    with thousands of pages is running, and a task whose queue runs dry
+    leaves its share of the pool to the tasks that still have pages.
+
+    When a pool process dies, for example when it runs out of memory on a
+    huge page, the pool is replaced and the units that were running are
+    run again, so that only the unit that keeps killing its process
+    fails.
+
+    Parameters
+    ----------
+    concurrency : int
+        Number of worker processes in the pool.
+
+    """
+
+    def __init__(self, concurrency):
+        self.concurrency = concurrency
+        self.pool = self._make_pool()
+        self.queues = collections.OrderedDict()
+        self.running = 0
+        # reentrant, since a unit that finishes right away calls back into
+        # the scheduler from within submit
+        self.lock = threading.RLock()
+
+    def _make_pool(self):
+        # spawn, since the pool is started from a process whose task
+        # threads may hold locks at the time
+        return ProcessPoolExecutor(
+            self.concurrency, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    def submit(self, key, func, *args, initializer=None, initargs=()):
+        """Queues a unit of work.
+
+        Parameters
+        ----------
+        key : hashable
+            Identifies the task that the unit belongs to.
+        func : callable
+            Picklable function that is called with args in a worker.
+        initializer : callable, optional (default: None)
+            Called with initargs in the worker before func. It has to be
+            cheap to call again, since workers run units of every task.
+
+        Returns
+        -------
+        future : concurrent.futures.Future
+
+        """
+        future = Future()
+        with self.lock:
+            queue = self.queues.setdefault(key, collections.deque())
+            queue.append(_Unit(key, future, func, args, initializer, initargs))
+            self._dispatch()
+        return future
+
+    def _dispatch(self):
+        # hands units to the pool while it has free workers, taking one
+        # unit from each task in turn
+        while self.running < self.concurrency and self.queues:
+            key, queue = next(iter(self.queues.items()))
+            unit = queue.popleft()
+            # the task goes to the back of the line
+            del self.queues[key]
+            if queue:
+                self.queues[key] = queue
+            if unit.attempts == 0 and not unit.future.set_running_or_notify_cancel():
+                continue
+            unit.attempts += 1
+            self.running += 1
+            args = (_run_unit, unit.initializer, unit.initargs, unit.func, unit.args)
+            pool = self.pool
+            try:
+                done = pool.submit(*args)
+            except BrokenProcessPool:
+                pool = self._replace_pool(pool)
+                done = pool.submit(*args)
+            done.add_done_callback(functools.partial(self._done, pool, unit))
+
+    def _replace_pool(self, pool):
+        # called with the lock held, once for every unit of a broken pool
+        if pool is self.pool:
+            self.pool = self._make_pool()
+            pool.shutdown(wait=False)
+        return self.pool
+
+    def _done(self, pool, unit, done):
+        exception = done.exception()
+        with self.lock:
+            self.running -= 1
+            if isinstance(exception, BrokenProcessPool):
+                self._replace_pool(pool)
+                if unit.attempts < MAX_ATTEMPTS:
+                    # the unit is run again before the rest of its task
+                    queue = self.queues.setdefault(unit.key, collections.deque())
+                    queue.appendleft(unit)
+                    self._dispatch()
+                    return
+            self._dispatch()
+        if exception is not None:
+            unit.future.set_exception(exception)
+        else:
+            unit.future.set_result(done.result())
+
+    def shutdown(self):
+        self.pool.shutdown()
+
+
+def start_scheduler(concurrency):
+    """Starts the page scheduler that every task in this process shares.
+
+    Parameters
+    ----------
+    concurrency : int
+        Number of worker processes in the scheduler's pool.
+
+    """
+    global _scheduler
+
+    _scheduler = PageScheduler(concurrency)
+
+
+def stop_scheduler():
+    """Stops the page scheduler of this process once its units are done."""
+    global _scheduler
+
+    if _scheduler is not None:
+        _scheduler.shutdown()
+        _scheduler = None
+
+
+def get_scheduler():
+    """Returns the page scheduler of this process, or None if the tasks
+    of this process use process pools of their own.
+    """
+    return _scheduler
@@ -1,13 +1,21 @@
+import io
 import os
 
 import cv2
+from camelot.core import TableList
+from camelot.handlers import PARSERS
 from camelot.utils import (
     get_image_char_and_text_objects,
-    get_page_layout,
     get_rotation,
+    remove_extra,
+    validate_input,
 )
 from pypdf import PdfReader, PdfWriter
 
+from .. import configuration as conf
+from .layout import get_page_layout
+from .render import RenderedPageBackend
+
 
 def get_pages(filename, pages, password=""):
     """Converts pages string to list of ints.
@@ -35,7 +43,7 @@ def get_pages(filename, pages, password=""):
     if pages == "1":
         page_numbers.append({"start": 1, "end": 1})
     else:
-        if infile.isEncrypted:
+        if infile.is_encrypted:
             infile.decrypt(password)
         if pages == "all":
             page_numbers.append({"start": 1, "end": len(infile.pages)})
@@ -55,36 +63,190 @@ def get_pages(filename, pages, password=""):
     return sorted(set(P)), N
 
 
-def save_page(filepath, page_number):
-    infile = PdfReader(open(filepath, "rb"), strict=False)
-    page = infile.pages[page_number - 1]
-    outfile = PdfWriter()
-    outfile.add_page(page)
-    outpath = os.path.join(os.path.dirname(filepath), f"page-{page_number}.pdf")
-    with open(outpath, "wb") as f:
-        outfile.write(f)
-    froot, fext = os.path.splitext(outpath)
-    layout, __ = get_page_layout(outpath)
-    # fix rotated PDF
+def save_pages(filepath, page_numbers, password=""):
+    """Splits a PDF into single-page PDFs next to it.
+
+    The source PDF is opened and parsed only once, and the pages are
+    written out one after another in the same pass.
+
+    Parameters
+    ----------
+    filepath : str
+        Path to PDF file.
+    page_numbers : list
+        List of int page numbers.
+    password : str, optional (default: '')
+        Password for decryption.
+
+    Returns
+    -------
+    outpaths : dict
+        Dict mapping each page number to its single-page PDF path.
+
+    """
+    outpaths = {}
+    dirname = os.path.dirname(filepath)
+    with open(filepath, "rb") as inputstream:
+        infile = PdfReader(inputstream, strict=False)
+        if infile.is_encrypted:
+            infile.decrypt(password)
+        for page_number in page_numbers:
+            outfile = PdfWriter()
+            outfile.add_page(infile.pages[page_number - 1])
+            outpath = os.path.join(dirname, f"page-{page_number}.pdf")
+            with open(outpath, "wb") as f:
+                outfile.write(f)
+            outpaths[page_number] = outpath
+    return outpaths
+
+
+def fix_rotation(pagepath):
+    """Rotates a single-page PDF in place if its text is rotated.
+
+    Parameters
+    ----------
+    pagepath : str
+        Path to single-page PDF file.
+
+    Returns
+    -------
+    rotation : str
+        '', 'clockwise' or 'anticlockwise'.
+
+    """
+    layout, __ = get_page_layout(pagepath)
     images, chars, horizontal_text, vertical_text = get_image_char_and_text_objects(
         layout
     )
     rotation = get_rotation(chars, horizontal_text, vertical_text)
     if rotation != "":
-        outpath_new = "".join([froot.replace("page", "p"), "_rotated", fext])
-        os.rename(outpath, outpath_new)
-        infile = PdfReader(open(outpath_new, "rb"), strict=False)
-        if infile.isEncrypted:
-            infile.decrypt("")
-        outfile = PdfWriter()
-        p = infile.pages[0]
+        with open(pagepath, "rb") as f:
+            infile = PdfReader(io.BytesIO(f.read()), strict=False)
+        page = infile.pages[0]
         if rotation == "anticlockwise":
-            p.rotateClockwise(90)
+            page.rotate(90)
         elif rotation == "clockwise":
-            p.rotateCounterClockwise(90)
-        outfile.add_page(p)
-        with open(outpath, "wb") as f:
+            page.rotate(-90)
+        outfile = PdfWriter()
+        outfile.add_page(page)
+        with open(pagepath, "wb") as f:
             outfile.write(f)
+    return rotation
+
+
+def save_page(filepath, page_number):
+    outpaths = save_pages(filepath, [page_number])
+    fix_rotation(outpaths[page_number])
+
+
+def read_pdf(filepath, flavor="lattice", layout_kwargs=None, **kwargs):
+    """Reads tables from a single-page PDF.
+
+    Same as camelot.read_pdf with pages='1', but the page is parsed in
+    place using its cached layout instead of being copied to a temporary
+    directory and laid out again.
+
+    Parameters
+    ----------
+    filepath : str
+        Path to single-page PDF file.
+    flavor : str (default: 'lattice')
+        The parsing method to use.
+    layout_kwargs : dict, optional (default: {})
+        A dict of pdfminer.layout.LAParams kwargs.
+    kwargs : dict
+        See camelot.read_pdf kwargs.
+
+    Returns
+    -------
+    tables : camelot.core.TableList
+
+    """
+    if layout_kwargs is None:
+        layout_kwargs = {}
+    if flavor not in PARSERS:
+        raise NotImplementedError(f"Unknown flavor specified: {flavor}")
+
+    if flavor == "lattice":
+        # reuse the page raster rendered during split
+        kwargs.setdefault("backend", RenderedPageBackend())
+    validate_input(kwargs, flavor=flavor)
+    kwargs = remove_extra(kwargs, flavor=flavor)
+    parser = PARSERS[flavor](**kwargs)
+
+    layout, dimensions = get_page_layout(filepath, **layout_kwargs)
+    images, chars, horizontal_text, vertical_text = get_image_char_and_text_objects(
+        layout
+    )
+    parser.prepare_page_parse(
+        filepath,
+        layout,
+        dimensions,
+        1,
+        images,
+        horizontal_text,
+        vertical_text,
+        layout_kwargs=layout_kwargs,
+    )
+    return TableList(sorted(parser.extract_tables()))
+
+
+def detect_areas(filepath, flavors=("lattice", "stream"), layout_kwargs=None):
+    """Detects table areas on a single-page PDF for several flavors.
+
+    The page is laid out and its text objects are extracted once, and
+    every flavor's table detection runs on those. Only the table
+    bounding boxes are computed, tables are not parsed into cells.
+
+    Parameters
+    ----------
+    filepath : str
+        Path to single-page PDF file.
+    flavors : tuple, optional (default: ('lattice', 'stream'))
+        The parsing methods to detect tables with.
+    layout_kwargs : dict, optional (default: {})
+        A dict of pdfminer.layout.LAParams kwargs.
+
+    Returns
+    -------
+    detected_areas : dict
+        Maps each flavor to a list of table areas in the form
+        (x1, y2, x2, y1), in the order read_pdf returns the tables,
+        or to None if no table was found.
+
+    """
+    if layout_kwargs is None:
+        layout_kwargs = {}
+
+    layout, dimensions = get_page_layout(filepath, **layout_kwargs)
+    images, chars, horizontal_text, vertical_text = get_image_char_and_text_objects(
+        layout
+    )
+    detected_areas = {}
+    for flavor in flavors:
+        if flavor == "lattice":
+            # reuse the page raster rendered during split
+            parser = PARSERS[flavor](backend=RenderedPageBackend())
+        else:
+            parser = PARSERS[flavor]()
+        parser.prepare_page_parse(
+            filepath,
+            layout,
+            dimensions,
+            1,
+            images,
+            horizontal_text,
+            vertical_text,
+            layout_kwargs=layout_kwargs,
+        )
+        areas = None
+        if not parser._document_has_no_text():
+            parser._generate_table_bbox()
+            bboxes = parser.table_bboxes()
+            if bboxes:
+                areas = [(x1, y2, x2, y1) for x1, y1, x2, y2 in bboxes]
+        detected_areas[flavor] = areas
+    return detected_areas
 
 
 def get_file_dim(filepath):
@@ -95,3 +257,23 @@ def get_file_dim(filepath):
 def get_image_dim(imagepath):
     image = cv2.imread(imagepath)
     return [image.shape[1], image.shape[0]]
+
+
+def get_concurrency(key):
+    """Returns the number of worker processes configured for a task.
+
+    Parameters
+    ----------
+    key : str
+        Option in the [core] section of excalibur.cfg.
+        A value of 0 means one worker per CPU core.
+
+    Returns
+    -------
+    concurrency : int
+
+    """
+    concurrency = int(conf.get("core", key))
+    if concurrency <= 0:
+        concurrency = os.cpu_count() or 1
+    return concurrency
@@ -1,3 +1,186 @@
+// https://coderwall.com/p/flonoa/simple-string-format-in-javascript
+String.prototype.format = function () {
+  let str = this;
+  for (let i in arguments) {
+    str = str.replace(new RegExp('\\{' + i + '\\}', 'gm'), arguments[i]);
+  }
+  return str;
+}
+
+let loadedTables = 0;
+let loadingTables = false;
+let titlesLoading = false;
+const loadedRows = {};
+const loadingRows = new Set();
+
+// adds the outline of a table, whose rows are loaded as it is scrolled
+// into view
+const addTable = function (index, table) {
+  const tr = $('<tr>');
+  for (let column = 0; column < table['shape'][1]; column++) {
+    tr.append($('<th>').text(column));
+  }
+  const card = $('<div class="card depth-1 mb-5 result-table">')
+    .attr('id', 'table-{0}'.format(index))
+    .data('title', table['title'])
+    .data('rows', table['shape'][0]);
+  const body = $('<div class="card-body p-0">').appendTo(card);
+  $('<table class="table text-left table-bordered table-hover mb-0">')
+    .append($('<caption class="text-right text-dark mr-3">').append($('<h6>').text(table['title'])))
+    .append($('<thead class="thead-light">').append(tr))
+    .append($('<tbody>'))
+    .appendTo(body);
+  $('#result-tables').append(card);
+  if (table['shape'][0] > 0) {
+    const loader = $('<div class="table-loader text-center text-muted p-2">Loading rows&hellip;</div>');
+    body.append(loader);
+    tableObserver.observe(loader[0]);
+  }
+};
+
+// fetches the next window of tables, until all tables are listed
+const loadTables = function (callback) {
+  if (loadingTables || loadedTables >= tableCount) {
+    return;
+  }
+  loadingTables = true;
+  $.ajax({
+    url: '/jobs/{0}/tables'.format(jobId),
+    data: {
+      start: loadedTables,
+      stop: loadedTables + tablesPerRequest
+    },
+    type: 'GET',
+    success: function (data) {
+      data['tables'].forEach(function (table, i) {
+        addTable(data['start'] + i, table);
+      });
+      loadedTables = data['stop'];
+      loadingTables = false;
+      const loader = $('#tables-loader')[0];
+      listObserver.unobserve(loader);
+      if (loadedTables >= tableCount || data['tables'].length === 0) {
+        $(loader).remove();
+      } else {
+        // the loader may still be in view after appending the tables
+        listObserver.observe(loader);
+      }
+      if (callback) {
+        callback();
+      }
+    },
+    error: function (error) {
+      loadingTables = false;
+      console.error(error);
+    }
+  });
+};
+
+// fills the table select with every title, the first time it is used
+const loadTitles = function (start) {
+  $.ajax({
+    url: '/jobs/{0}/tables'.format(jobId),
+    data: {
+      start: start,
+      stop: start + tablesPerRequest
+    },
+    type: 'GET',
+    success: function (data) {
+      data['tables'].forEach(function (table, i) {
+        $('#table-select').append($('<option>').val(data['start'] + i).text(table['title']));
+      });
+      if (data['stop'] < data['total'] && data['tables'].length > 0) {
+        loadTitles(data['stop']);
+      }
+    },
+    error: function (error) {
+      console.error(error);
+    }
+  });
+};
+
+// scrolls to a table, listing the tables before it first if needed
+const showTable = function (index) {
+  if (index < loadedTables) {
+    const card = document.getElementById('table-{0}'.format(index));
+    card.scrollIntoView();
+    loadRows(card);
+  } else if (loadingTables) {
+    // wait for the tables that are being listed already
+    setTimeout(function () {
+      showTable(index);
+    }, 100);
+  } else if (loadedTables < tableCount) {
+    loadTables(function () {
+      showTable(index);
+    });
+  }
+};
+
+// fetches the next window of rows of a table, until all rows are loaded
+const loadRows = function (card) {
+  const id = card.id;
+  const rows = parseInt($(card).data('rows'));
+  const start = loadedRows[id] || 0;
+  if (loadingRows.has(id) || start >= rows) {
+    return;
+  }
+  loadingRows.add(id);
+  $.ajax({
+    url: '/jobs/{0}/tables/{1}'.format(jobId, encodeURIComponent($(card).data('title'))),
+    data: {
+      start: start,
+      stop: start + rowsPerRequest
+    },
+    type: 'GET',
+    success: function (data) {
+      const tbody = $(card).find('tbody');
+      data['records'].forEach(function (record) {
+        const tr = $('<tr>');
+        record.forEach(function (cell) {
+          tr.append($('<td>').text(cell));
+        });
+        tbody.append(tr);
+      });
+      loadedRows[id] = data['stop'];
+      loadingRows.delete(id);
+      const loader = $(card).find('.table-loader')[0];
+      if (loader === undefined) {
+        return;
+      }
+      tableObserver.unobserve(loader);
+      if (loadedRows[id] >= rows || data['records'].length === 0) {
+        $(loader).remove();
+      } else {
+        // the loader may still be in view after appending the rows
+        tableObserver.observe(loader);
+      }
+    },
+    error: function (error) {
+      loadingRows.delete(id);
+      console.error(error);
+    }
+  });
+};
+
+// tables load their rows when the end of what is shown so far comes into view
+const tableObserver = new IntersectionObserver(function (entries) {
+  entries.forEach(function (entry) {
+    if (entry.isIntersecting) {
+      loadRows($(entry.target).closest('.result-table')[0]);
+    }
+  });
+}, {rootMargin: '200px'});
+
+// more tables are listed when the end of the list comes into view
+const listObserver = new IntersectionObserver(function (entries) {
+  entries.forEach(function (entry) {
+    if (entry.isIntersecting) {
+      loadTables();
+    }
+  });
+}, {rootMargin: '200px'});
+
 $(document).ready(function () {
   var loc = window.location.pathname.split('/');
 
@@ -6,4 +189,19 @@ $(document).ready(function () {
     $('#download-form').append($(input));
     $('#download-form').submit();
   });
+
+  if ($('#tables-loader').length) {
+    listObserver.observe($('#tables-loader')[0]);
+  }
+
+  $('#table-select').on('focus mousedown', function () {
+    if (!titlesLoading) {
+      titlesLoading = true;
+      loadTitles(0);
+    }
+  });
+
+  $('#table-select').change(function () {
+    showTable(parseInt($(this).val()));
+  });
 });
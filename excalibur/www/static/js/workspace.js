@@ -195,7 +195,7 @@ const getRuleOptions = function () {
   }
 
   // table areas and columns for each page
-  for (let page in detectedAreas) {
+  for (let page in fileDims) {
     ruleOptions['pages'][page] = {};
     const selectedAreas = $('#image-{0}'.format(page)).selectAreas('areas');
     const hasColumnSeparator = $('#image-div-{0} > .draggable-column'.format(page)).length > 0;
@@ -331,8 +331,90 @@ const debugQtyAreas = function (event, id, areas) {
   return;
 };
 
+// pages which are still being split or detected
+
+let visiblePages = new Set();
+
+const pageObserver = new IntersectionObserver(function (entries) {
+  entries.forEach(function (entry) {
+    const page = entry.target.id.replace('image-', '');
+    if (entry.isIntersecting) {
+      visiblePages.add(page);
+    } else {
+      visiblePages.delete(page);
+    }
+  });
+});
+
+const addPage = function (page, imagepath, thumbnailpath) {
+  const loc = window.location.pathname.split('/');
+  const separatorDisabled = $('.add-separator').first().prop('disabled');
+  const thumbnail = $('<li id="thumbnail-page"><a href="#image-div-{0}"><img src="{1}" id="image" class="img-thumbnail"/></a><p class="text-center">{0}</p></li>'.format(page, thumbnailpath));
+  $('#thumbnail-list').append(thumbnail);
+
+  const separator = $('<div class="row mx-0 mb-2"><div class="col-md-3 col-sm-3 col-xs-3"><button type="button" class="btn btn-block btn-primary add-separator mt-1" onclick="onAddSeparatorClick(this)" data-page="{0}"><i class="fas fa-columns mr-2"></i>Add column</button></div><div class="col-md-3 col-sm-3 col-xs-3"><a class="btn btn-block btn-outline-secondary mt-1" href="/workspaces/{1}/pages/{0}" target="_blank"><i class="fas fa-search-plus mr-2"></i>Zoom</a></div></div>'.format(page, loc[loc.length - 1]));
+  const image = $('<div class="row mx-0 mb-2"><div class="col-md-12 col-sm-12 col-xs-12"><div id="image-div-{0}"><img src="{1}" id="image-{0}" class="image-area"/></div></div></div>'.format(page, imagepath));
+  $('.page-container').append(separator, image);
+  separator.find('.add-separator').prop('disabled', separatorDisabled);
+
+  // the image has to be loaded for its size to be known
+  $('#image-{0}'.format(page)).on('load', function () {
+    $(this).selectAreas({
+      onChanged: debugQtyAreas
+    });
+  });
+  pageObserver.observe(document.getElementById('image-{0}'.format(page)));
+};
+
+const pollPages = function () {
+  const loc = window.location.pathname.split('/');
+  $.ajax({
+    url: '/workspaces/{0}/pages'.format(loc[loc.length - 1]),
+    data: {
+      priority: Array.from(visiblePages).sort(compare).join(),
+      cursor: pagesCursor
+    },
+    type: 'GET',
+    success: function (data) {
+      // only the pages that changed since the last poll are sent
+      pagesCursor = data['cursor'];
+      const pages = Object.keys(data['imagepaths']).sort(compare);
+      pages.forEach(function (page) {
+        if (!(page in fileDims)) {
+          fileDims[page] = data['filedims'][page];
+          imageDims[page] = data['imagedims'][page];
+          addPage(page, data['imagepaths'][page], data['thumbnailpaths'][page]);
+        }
+        if (!(page in detectedAreas) && page in data['detected_areas']) {
+          detectedAreas[page] = data['detected_areas'][page];
+        }
+      });
+      $('#ready-pages').text(data['ready_pages']);
+      if (data['is_split']) {
+        $('#split-progress').hide();
+      }
+      if (data['state'] === 'failed') {
+        $('#split-progress p').text('Processing failed after {0} pages.'.format(data['ready_pages']));
+        return;
+      }
+      if (!(data['is_split'] && data['is_detected'])) {
+        setTimeout(pollPages, 1000);
+      }
+    },
+    error: function (error) {
+      console.error(error);
+    }
+  });
+};
+
 $(document).ready(function () {
   $('.image-area').selectAreas({
     onChanged: debugQtyAreas
   });
+  $('.image-area').each(function () {
+    pageObserver.observe(this);
+  });
+  if (!(isSplit && isDetected)) {
+    setTimeout(pollPages, 1000);
+  }
 });
@@ -1,30 +1,42 @@
 import os
-import re
-import glob
 import json
 import datetime as dt
 
-import pandas as pd
 from flask import (
     Blueprint,
+    abort,
     jsonify,
     request,
     url_for,
     redirect,
     render_template,
-    send_from_directory,
+    send_file,
 )
+from sqlalchemy import func
 from werkzeug.utils import secure_filename
 
 from .. import configuration as conf
-from ..models import Job, File, Rule
+from ..models import Batch, Job, File, FilePage, Rule, Task, TaskState
 from ..settings import Session
 from ..executors import get_default_executor
-from ..utils.file import mkdirs, allowed_filename
+from ..executors.base_executor import TaskHandle
+from ..tasks import get_file_pages
+from ..utils.export import (
+    RESULT_FILENAME,
+    get_batch_export,
+    get_export,
+    read_table,
+)
+from ..utils.file import mkdirs, save_and_hash, allowed_filename
 from ..utils.metadata import generate_uuid, random_string
+from ..utils.render import render_high_resolution
 
 views = Blueprint("views", __name__)
 
+# seconds that a poll for the pages of a workspace looks back behind its
+# cursor, since a page can be committed a little after it was stored
+CURSOR_LAG = 2
+
 
 @views.route("/", methods=["GET"])
 def index():
@@ -62,11 +74,12 @@ def files():
         filepath = os.path.join(conf.PDFS_FOLDER, file_id)
         mkdirs(filepath)
         filepath = os.path.join(filepath, filename)
-        file.save(filepath)
+        file_hash = save_and_hash(file, filepath)
 
         session = Session()
         f = File(
             file_id=file_id,
+            file_hash=file_hash,
             uploaded_at=uploaded_at,
             pages=pages,
             filename=filename,
@@ -79,8 +92,68 @@ def files():
         command = "excalibur run --task {} --uuid {}".format("split", file_id)
         command_as_list = command.split(" ")
         executor = get_default_executor()
-        executor.execute_async(command_as_list)
-    return jsonify(file_id=file_id)
+        handle = executor.execute_async(command_as_list)
+    return jsonify(file_id=file_id, task_id=handle.task_id)
+
+
+def get_task(session, target_id):
+    """Returns the latest task that was queued on a file, job or batch."""
+    return (
+        session.query(Task)
+        .filter(Task.target_id == target_id)
+        .order_by(Task.queued_at.desc())
+        .first()
+    )
+
+
+def get_ready_pages(session, file, cursor=None):
+    """Returns the pages of a file that split has finished so far.
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.Session
+    file : excalibur.models.File
+    cursor : str, optional (default: None)
+        The cursor that an earlier call returned, to only return the
+        pages that were stored or updated since then.
+
+    """
+    now = session.query(func.now()).scalar()
+    since = None
+    if cursor:
+        try:
+            since = dt.datetime.fromisoformat(cursor)
+        except ValueError:
+            pass
+    pages = get_file_pages(session, file.file_id, since=since)
+    count = session.query(func.count(FilePage.page)).filter(
+        FilePage.file_id == file.file_id
+    )
+    ready_pages = count.scalar()
+    detected_pages = count.filter(FilePage.detected_areas.isnot(None)).scalar()
+    extract_pages = len(json.loads(file.extract_pages))
+    www = os.path.join(conf.PROJECT_ROOT, "www")
+    return {
+        "is_split": ready_pages == extract_pages,
+        "is_detected": detected_pages == extract_pages,
+        "ready_pages": ready_pages,
+        # a page that was stored just before this call may only be
+        # committed after it, so the next call looks back a little
+        "cursor": (now - dt.timedelta(seconds=CURSOR_LAG)).isoformat(),
+        "imagepaths": {
+            str(page): r["imagepaths"].replace(www, "") for page, r in pages.items()
+        },
+        "thumbnailpaths": {
+            str(page): r["thumbnailpaths"].replace(www, "") for page, r in pages.items()
+        },
+        "filedims": {str(page): r["filedims"] for page, r in pages.items()},
+        "imagedims": {str(page): r["imagedims"] for page, r in pages.items()},
+        "detected_areas": {
+            str(page): r["detected_areas"]
+            for page, r in pages.items()
+            if r["detected_areas"] is not None
+        },
+    }
 
 
 @views.route("/workspaces/<string:file_id>", methods=["GET"])
@@ -88,32 +161,88 @@ def workspaces(file_id):
     session = Session()
     file = session.query(File).filter(File.file_id == file_id).first()
     rules = session.query(Rule).order_by(Rule.created_at.desc()).all()
-    session.close()
-    imagepaths, saved_rules = (None for i in range(2))
+    task = get_task(session, file_id)
+    imagepaths, thumbnailpaths, saved_rules, cursor = (None for i in range(4))
     filedims, imagedims, detected_areas = ("null" for i in range(3))
+    is_split, is_detected = (False for i in range(2))
     if file.has_image:
-        imagepaths = json.loads(file.imagepaths)
-        for page in imagepaths:
-            imagepaths[page] = imagepaths[page].replace(
-                os.path.join(conf.PROJECT_ROOT, "www"), ""
-            )
-        filedims = file.filedims
-        imagedims = file.imagedims
-        detected_areas = file.detected_areas
+        pages = get_ready_pages(session, file)
+        is_split = pages["is_split"]
+        is_detected = pages["is_detected"]
+        imagepaths = pages["imagepaths"]
+        thumbnailpaths = pages["thumbnailpaths"]
+        filedims = json.dumps(pages["filedims"])
+        imagedims = json.dumps(pages["imagedims"])
+        detected_areas = json.dumps(pages["detected_areas"])
+        cursor = pages["cursor"]
         saved_rules = [
             {"rule_id": rule.rule_id, "rule_name": rule.rule_name} for rule in rules
         ]
+    session.close()
     return render_template(
         "workspace.html",
+        file_id=file_id,
         filename=file.filename,
+        is_split=is_split,
+        is_detected=is_detected,
+        page_count=len(json.loads(file.extract_pages)) if file.has_image else 0,
         imagepaths=imagepaths,
+        thumbnailpaths=thumbnailpaths,
         filedims=filedims,
         imagedims=imagedims,
         detected_areas=detected_areas,
         saved_rules=saved_rules,
+        cursor=cursor,
+        split_failed=task is not None and task.state == TaskState.FAILED,
     )
 
 
+@views.route("/workspaces/<string:file_id>/pages", methods=["GET"])
+def workspace_pages(file_id):
+    session = Session()
+    file = session.query(File).filter(File.file_id == file_id).first()
+    # pages that are open in the workspace get their table areas detected first
+    # malformed page numbers are ignored
+    priority = request.args.get("priority", "").split(",")
+    pages = [int(page) for page in priority if page.strip().isdigit()]
+    if pages:
+        requested_pages = json.dumps(pages)
+        if requested_pages != file.requested_pages:
+            file.requested_pages = requested_pages
+            session.commit()
+    task = get_task(session, file_id)
+    state = task.state if task is not None else None
+    if not file.has_image:
+        session.close()
+        return jsonify(
+            is_split=False,
+            is_detected=False,
+            ready_pages=0,
+            imagepaths={},
+            state=state,
+        )
+    # only the pages that changed since the client's last poll are sent
+    pages = get_ready_pages(session, file, request.args.get("cursor"))
+    session.close()
+    return jsonify(state=state, **pages)
+
+
+@views.route("/workspaces/<string:file_id>/pages/<string:page>", methods=["GET"])
+def workspace_page_image(file_id, page):
+    session = Session()
+    row = None
+    if page.isdigit():
+        row = (
+            session.query(FilePage)
+            .filter(FilePage.file_id == file_id, FilePage.page == int(page))
+            .first()
+        )
+    session.close()
+    if row is None:
+        abort(404)
+    return send_file(render_high_resolution(row.filepath))
+
+
 @views.route("/rules", methods=["GET", "POST"], defaults={"rule_id": None})
 @views.route("/rules/<string:rule_id>", methods=["GET"])
 def rules(rule_id):
@@ -170,26 +299,25 @@ def jobs(job_id):
         if job_id is not None:
             session = Session()
             job = session.query(Job).filter(Job.job_id == job_id).first()
+            # jobs of a batch are extracted by the batch's task
+            task = get_task(session, job.batch_id or job_id)
             session.close()
 
-            data = []
-            render_files = json.loads(job.render_files)
-            regex = r"page-(\d)+-table-(\d)+"
-            for k in sorted(
-                render_files,
-                key=lambda x: (int(re.split(regex, x)[1]), int(re.split(regex, x)[2])),
-            ):
-                df = pd.read_json(render_files[k])
-                columns = df.columns.values
-                records = df.to_dict("records")
-                data.append({"title": k, "columns": columns, "records": records})
+            # the tables are listed from job_tables and their rows are
+            # fetched from job_table as they are scrolled into view, so
+            # that the page is the same size however many tables there are
             return render_template(
                 "job.html",
+                job_id=job_id,
                 is_finished=job.is_finished,
                 started_at=job.started_at,
                 finished_at=job.finished_at,
                 datapath=job.datapath,
-                data=data,
+                table_count=len(json.loads(job.render_files or "[]")),
+                tables_per_request=int(conf.get("webserver", "tables_per_request")),
+                rows_per_request=int(conf.get("webserver", "table_rows_per_request")),
+                task=task,
+                task_failed=task is not None and task.state == TaskState.FAILED,
             )
         jobs_response = []
         session = Session()
@@ -241,8 +369,211 @@ def jobs(job_id):
     command = "excalibur run --task {} --uuid {}".format("extract", job_id)
     command_as_list = command.split(" ")
     executor = get_default_executor()
-    executor.execute_async(command_as_list)
-    return jsonify(job_id=job_id)
+    handle = executor.execute_async(command_as_list)
+    return jsonify(job_id=job_id, task_id=handle.task_id)
+
+
+@views.route("/jobs/<string:job_id>/tables", methods=["GET"])
+def job_tables(job_id):
+    """Returns a window of the titles and shapes of the tables extracted
+    by a job, in page order.
+
+    The window starts at the 'start' table and ends before the 'stop'
+    table, and holds at most [webserver] tables_per_request tables.
+    """
+    session = Session()
+    job = session.query(Job).filter(Job.job_id == job_id).first()
+    session.close()
+    if job is None or not job.is_finished:
+        abort(404)
+    render_files = json.loads(job.render_files)
+    titles = sorted(
+        render_files,
+        key=lambda x: (render_files[x]["page"], render_files[x]["table"]),
+    )
+
+    tables_per_request = int(conf.get("webserver", "tables_per_request"))
+    start = max(request.args.get("start", 0, type=int), 0)
+    stop = request.args.get("stop", start + tables_per_request, type=int)
+    stop = max(min(stop, start + tables_per_request, len(titles)), start)
+    return jsonify(
+        total=len(titles),
+        start=start,
+        stop=stop,
+        tables=[
+            {"title": title, "shape": render_files[title]["shape"]}
+            for title in titles[start:stop]
+        ],
+    )
+
+
+@views.route("/jobs/<string:job_id>/tables/<string:table_name>", methods=["GET"])
+def job_table(job_id, table_name):
+    """Returns a window of rows of a table extracted by a job.
+
+    The window starts at the 'start' row and ends before the 'stop' row,
+    and holds at most [webserver] table_rows_per_request rows.
+    """
+    session = Session()
+    job = session.query(Job).filter(Job.job_id == job_id).first()
+    session.close()
+    if job is None or not job.is_finished:
+        abort(404)
+    render_files = json.loads(job.render_files)
+    if table_name not in render_files:
+        abort(404)
+
+    table = render_files[table_name]
+    nrows, ncols = table["shape"]
+    rows_per_request = int(conf.get("webserver", "table_rows_per_request"))
+    start = max(request.args.get("start", 0, type=int), 0)
+    stop = request.args.get("stop", start + rows_per_request, type=int)
+    stop = min(stop, start + rows_per_request, nrows)
+
+    df = read_table(
+        os.path.join(job.datapath, RESULT_FILENAME), table, rows=(start, stop)
+    )
+    return jsonify(
+        title=table_name,
+        shape=table["shape"],
+        start=start,
+        stop=max(stop, start),
+        columns=df.columns.tolist(),
+        records=df.values.tolist(),
+    )
+
+
+@views.route("/batches", methods=["POST"])
+def batches():
+    """Applies a saved rule to several uploaded files in one submission.
+
+    The form holds the rule_id and a JSON list of file_ids. A job is
+    created for every file, and all of them are extracted by a single
+    extract_batch task. Every file has to be split before its tables can
+    be extracted.
+    """
+    rule_id = request.form["rule_id"]
+    file_ids = json.loads(request.form["file_ids"])
+    if not file_ids or len(set(file_ids)) != len(file_ids):
+        abort(400)
+
+    session = Session()
+    rule = session.query(Rule).filter(Rule.rule_id == rule_id).first()
+    files = session.query(File).filter(File.file_id.in_(file_ids)).count()
+    if rule is None or files != len(file_ids):
+        session.close()
+        abort(404)
+    for file_id in file_ids:
+        task = get_task(session, file_id)
+        if task is None or task.state != TaskState.SUCCEEDED:
+            session.close()
+            abort(409)
+
+    batch_id = generate_uuid()
+    started_at = dt.datetime.now()
+    b = Batch(
+        batch_id=batch_id,
+        rule_id=rule_id,
+        file_ids=json.dumps(file_ids),
+        datapath=os.path.join(conf.PDFS_FOLDER, batch_id),
+        total_jobs=len(file_ids),
+        started_at=started_at,
+    )
+    session.add(b)
+    for file_id in file_ids:
+        j = Job(
+            job_id=generate_uuid(),
+            started_at=started_at,
+            file_id=file_id,
+            rule_id=rule_id,
+            batch_id=batch_id,
+        )
+        session.add(j)
+    session.commit()
+    session.close()
+
+    command = "excalibur run --task {} --uuid {}".format("extract_batch", batch_id)
+    command_as_list = command.split(" ")
+    executor = get_default_executor()
+    handle = executor.execute_async(command_as_list)
+    return jsonify(batch_id=batch_id, task_id=handle.task_id)
+
+
+@views.route("/batches/<string:batch_id>", methods=["GET"])
+def batch(batch_id):
+    """Returns the progress of a batch and the jobs it is made of."""
+    session = Session()
+    b = session.query(Batch).filter(Batch.batch_id == batch_id).first()
+    if b is None:
+        session.close()
+        abort(404)
+    jobs = {
+        job.file_id: job
+        for job in session.query(Job).filter(Job.batch_id == batch_id).all()
+    }
+    session.close()
+
+    return jsonify(
+        batch_id=batch_id,
+        rule_id=b.rule_id,
+        is_finished=b.is_finished,
+        total_jobs=b.total_jobs,
+        finished_jobs=b.finished_jobs,
+        started_at=b.started_at.strftime("%Y-%m-%dT%H:%M:%S"),
+        finished_at=(
+            b.finished_at.strftime("%Y-%m-%dT%H:%M:%S") if b.finished_at else None
+        ),
+        jobs=[
+            {
+                "job_id": jobs[file_id].job_id,
+                "file_id": file_id,
+                "is_finished": jobs[file_id].is_finished,
+            }
+            for file_id in json.loads(b.file_ids)
+        ],
+    )
+
+
+@views.route("/batches/<string:batch_id>/download", methods=["GET"])
+def batch_download(batch_id):
+    """Returns the combined export of a finished batch in the format
+    given by the 'format' argument.
+    """
+    f = request.args.get("format", "csv").lower()
+
+    session = Session()
+    b = session.query(Batch).filter(Batch.batch_id == batch_id).first()
+    if b is None or not b.is_finished:
+        session.close()
+        abort(404)
+    rule = session.query(Rule).filter(Rule.rule_id == b.rule_id).first()
+    exports = []
+    for file_id in json.loads(b.file_ids):
+        job = (
+            session.query(Job)
+            .filter(Job.batch_id == batch_id, Job.file_id == file_id)
+            .first()
+        )
+        file = session.query(File).filter(File.file_id == file_id).first()
+        froot, __ = os.path.splitext(file.filename)
+        exports.append(
+            (froot, get_export(job.datapath, froot, json.loads(job.render_files), f))
+        )
+    session.close()
+
+    exportpath = get_batch_export(b.datapath, rule.rule_name, exports, f)
+    return send_file(exportpath, as_attachment=True)
+
+
+@views.route("/tasks/<string:task_id>", methods=["GET"])
+def task(task_id):
+    """Returns the state and page progress of a task, as returned by the
+    executor when the task was queued.
+    """
+    status = TaskHandle(task_id).status()
+    if status is None:
+        abort(404)
+    return jsonify(**status)
 
 
 @views.route("/download", methods=["POST"])
@@ -252,13 +583,11 @@ def download():
 
     session = Session()
     job = session.query(Job).filter(Job.job_id == job_id).first()
+    file = session.query(File).filter(File.file_id == job.file_id).first()
     session.close()
 
-    datapath = os.path.join(job.datapath, f.lower())
-    zipfile = glob.glob(os.path.join(datapath, "*.zip"))[0]
-
-    directory = os.path.join(os.getcwd(), datapath)
-    filename = os.path.basename(zipfile)
-    return send_from_directory(
-        directory=directory, filename=filename, as_attachment=True
+    froot, __ = os.path.splitext(file.filename)
+    exportpath = get_export(
+        job.datapath, froot, json.loads(job.render_files), f.lower()
     )
+    return send_file(exportpath, as_attachment=True)
@@ -0,0 +1,115 @@
+import datetime as dt
+import threading
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+
+from excalibur.executors import base_executor
+from excalibur.executors.database_executor import claim_tasks, run_tasks
+from excalibur.models import Base, Task, TaskState
+
+
+def make_session(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'excalibur.db'}")
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine, expire_on_commit=False)
+
+
+def add_task(session, task_id, state=TaskState.QUEUED, **kwargs):
+    session.add(
+        Task(
+            task_id=task_id,
+            task_name="extract",
+            target_id=task_id,
+            state=state,
+            queued_at=dt.datetime.now(),
+            **kwargs,
+        )
+    )
+    session.commit()
+
+
+def test_claim_tasks_once(tmp_path):
+    Session = make_session(tmp_path)
+    session = Session()
+    for i in range(60):
+        add_task(session, str(i))
+    session.close()
+
+    claimed = []
+    barrier = threading.Barrier(4)
+
+    def claim(worker_name):
+        session = Session()
+        barrier.wait()
+        while True:
+            tasks = claim_tasks(
+                session, worker_name, 3, lease_timeout=60, max_attempts=3
+            )
+            if not tasks:
+                break
+            claimed.extend(task_id for task_id, __, __ in tasks)
+        session.close()
+
+    workers = [threading.Thread(target=claim, args=(f"w{i}",)) for i in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert sorted(claimed, key=int) == [str(i) for i in range(60)]
+
+
+def test_claim_tasks_reclaims_expired_lease(tmp_path):
+    Session = make_session(tmp_path)
+    session = Session()
+    now = session.query(func.now()).scalar()
+    expired = now - dt.timedelta(minutes=2)
+    add_task(
+        session,
+        "orphaned",
+        TaskState.RUNNING,
+        claimed_by="dead",
+        heartbeat_at=expired,
+        attempts=1,
+    )
+    add_task(
+        session,
+        "alive",
+        TaskState.RUNNING,
+        claimed_by="alive",
+        heartbeat_at=now,
+        attempts=1,
+    )
+    tasks = claim_tasks(session, "worker", 10, lease_timeout=60, max_attempts=2)
+    assert [task_id for task_id, __, __ in tasks] == ["orphaned"]
+    task = session.get(Task, "orphaned", populate_existing=True)
+    assert (task.state, task.claimed_by, task.attempts) == (
+        TaskState.CLAIMED,
+        "worker",
+        2,
+    )
+
+    # a task that keeps losing its worker is failed once it used up its
+    # attempts
+    task.heartbeat_at = expired
+    session.commit()
+    assert claim_tasks(session, "worker", 10, lease_timeout=60, max_attempts=2) == []
+    task = session.get(Task, "orphaned", populate_existing=True)
+    assert task.state == TaskState.FAILED
+    assert session.get(Task, "alive").state == TaskState.RUNNING
+    session.close()
+
+
+def test_run_tasks_fails_task(tmp_path, monkeypatch):
+    Session = make_session(tmp_path)
+    monkeypatch.setattr(base_executor, "Session", Session)
+    session = Session()
+    add_task(session, "unknown")
+    session.query(Task).update({Task.task_name: "unknown"})
+    session.commit()
+    tasks = claim_tasks(session, "worker", 1, lease_timeout=60, max_attempts=3)
+    assert tasks == [("unknown", "unknown", "unknown")]
+    run_tasks(tasks)
+    task = session.get(Task, "unknown", populate_existing=True)
+    assert task.state == TaskState.FAILED
+    session.close()
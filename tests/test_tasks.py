@@ -0,0 +1,150 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+from pypdf import PdfWriter
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from excalibur import tasks
+from excalibur.models import Base, File, FilePage, Job, Result
+from excalibur.utils.export import RESULT_FILENAME, read_table
+from excalibur.utils.render import close_document, open_document
+from excalibur.utils.task import save_pages
+
+
+def make_session(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'excalibur.db'}")
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine, expire_on_commit=False)()
+
+
+def test_cache_result_evicts_rows(tmp_path, monkeypatch):
+    session = make_session(tmp_path)
+    cachedir = tmp_path / "results"
+    monkeypatch.setattr(tasks, "_get_result_cache", lambda: (str(cachedir), 150))
+
+    for key in ["a", "b"]:
+        resultpath = tmp_path / f"{key}.parquet"
+        resultpath.write_bytes(b"x" * 100)
+        tasks._cache_result(session, key, str(resultpath), [{"page": 1}])
+        session.commit()
+    # the least recently used result is evicted along with its row
+    assert sorted(p.name for p in cachedir.iterdir()) == ["b.parquet"]
+    assert [r.result_key for r in session.query(Result)] == ["b"]
+
+    resultpath = tmp_path / "result.parquet"
+    assert tasks._get_cached_result(session, "a", str(resultpath)) is None
+    tables = tasks._get_cached_result(session, "b", str(resultpath))
+    assert tables == [{"page": 1}]
+    assert resultpath.read_bytes() == b"x" * 100
+
+    # a row whose file is gone is dropped when it is looked up
+    (cachedir / "b.parquet").unlink()
+    assert tasks._get_cached_result(session, "b", str(resultpath)) is None
+    assert session.query(Result).count() == 0
+    session.close()
+
+
+class Table:
+    def __init__(self, page, order, df):
+        self.page, self.order, self.df = page, order, df
+
+
+def _add_job(session, file, job_id, rule_options):
+    job = Job(job_id=job_id, file_id=file.file_id)
+    session.add(job)
+    session.commit()
+    for job in tasks._extract_jobs(session, [(job, file)], rule_options):
+        pass
+    return job
+
+
+def test_extract_reuses_unchanged_pages(tmp_path, monkeypatch):
+    session = make_session(tmp_path)
+    monkeypatch.setattr(tasks, "_get_result_cache", lambda: (None, 0))
+    monkeypatch.setattr(tasks, "get_concurrency", lambda key: 1)
+
+    extracted = []
+
+    def extract_page(filepath, kwargs):
+        extracted.append(filepath)
+        page = os.path.basename(filepath)
+        df = pd.DataFrame([[page, str(kwargs["line_scale"])]])
+        return [Table(0, 1, df)]
+
+    monkeypatch.setattr(tasks, "_extract_page", extract_page)
+
+    file = File(file_id="foo", filename="foo.pdf", filepath=str(tmp_path / "foo.pdf"))
+    session.add(file)
+    for page in [1, 2, 3]:
+        session.add(
+            FilePage(
+                file_id="foo",
+                page=page,
+                filepath=f"page-{page}.pdf",
+                imagepath=f"page-{page}.png",
+                thumbnailpath=f"page-{page}.jpg",
+                filedims="[100, 100]",
+                imagedims="[100, 100]",
+            )
+        )
+    session.commit()
+
+    rule_options = {
+        "flavor": "Lattice",
+        "pages": {p: {"line_scale": 15} for p in ["1", "2", "3"]},
+    }
+    _add_job(session, file, "first", rule_options)
+    assert extracted == ["page-1.pdf", "page-2.pdf", "page-3.pdf"]
+
+    # only the page whose options changed is extracted again, and the
+    # result keeps the tables of every page in page order
+    extracted.clear()
+    rule_options["pages"]["2"] = {"line_scale": 40}
+    job = _add_job(session, file, "second", rule_options)
+    assert extracted == ["page-2.pdf"]
+
+    render_files = json.loads(job.render_files)
+    assert [t["page"] for t in render_files.values()] == [1, 2, 3]
+    resultpath = os.path.join(job.datapath, RESULT_FILENAME)
+    assert [
+        read_table(resultpath, t).values.tolist() for t in render_files.values()
+    ] == [[["page-1.pdf", "15"]], [["page-2.pdf", "40"]], [["page-3.pdf", "15"]]]
+
+    # a page that was not split fails the job instead of being left out
+    rule_options["pages"]["4"] = {"line_scale": 15}
+    with pytest.raises(ValueError, match="Pages 4 were not split"):
+        _add_job(session, file, "third", rule_options)
+    session.close()
+
+
+def test_split_pages_serial_parallel(tmp_path):
+    filepath = str(tmp_path / "foo.pdf")
+    writer = PdfWriter()
+    for width in [100, 200, 300, 400]:
+        writer.add_blank_page(width=width, height=100)
+    with open(filepath, "wb") as f:
+        writer.write(f)
+    outpaths = save_pages(filepath, [1, 2, 3, 4])
+    pages = sorted(outpaths)
+
+    pagepaths = [outpaths[page] for page in pages]
+
+    def split_pages(concurrency):
+        results = tasks._map_pages(
+            tasks._split_page,
+            pagepaths,
+            pages,
+            concurrency,
+            initializer=open_document,
+            initargs=(filepath,),
+        )
+        return list(results)
+
+    serial = split_pages(1)
+    close_document()
+    parallel = split_pages(2)
+    assert parallel == serial
+    assert [r["filedims"][0] for r in serial] == [100, 200, 300, 400]
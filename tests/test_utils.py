@@ -1,6 +1,236 @@
-from excalibur.utils.file import allowed_filename
+import hashlib
+import io
+import os
+import zipfile
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+from pypdf import PdfReader, PdfWriter
+
+from excalibur import configuration as conf
+from excalibur.utils.export import (
+    RESULT_FILENAME,
+    ResultWriter,
+    get_export,
+    get_result_key,
+    read_table,
+)
+from excalibur.utils.file import allowed_filename, evict_files, save_and_hash
+from excalibur.utils.layout import get_layout_key
+from excalibur.utils.scheduler import PageScheduler
+from excalibur.utils.task import get_concurrency, save_pages
 
 
 def test_allowed_filename():
     assert not allowed_filename("foo.bar")
     assert allowed_filename("foo.pdf")
+
+
+def test_save_and_hash(tmp_path):
+    class Upload:
+        stream = io.BytesIO(b"%PDF-1.4" * 300000)
+
+    filepath = str(tmp_path / "foo.pdf")
+    file_hash = save_and_hash(Upload, filepath)
+    with open(filepath, "rb") as f:
+        content = f.read()
+    assert content == b"%PDF-1.4" * 300000
+    assert file_hash == hashlib.sha256(content).hexdigest()
+
+
+def test_evict_files(tmp_path):
+    for i, name in enumerate(["a", "b", "c"]):
+        path = tmp_path / f"{name}.parquet"
+        path.write_bytes(b"x" * 100)
+        os.utime(path, (i, i))
+    (tmp_path / "d.tmp").write_bytes(b"x" * 1000)
+
+    removed = evict_files(str(tmp_path), 250, ".parquet")
+    assert removed == [str(tmp_path / "a.parquet")]
+    assert sorted(os.listdir(tmp_path)) == ["b.parquet", "c.parquet", "d.tmp"]
+
+
+def test_get_concurrency(monkeypatch):
+    monkeypatch.setattr(conf, "get", lambda section, key: "3")
+    assert get_concurrency("split_concurrency") == 3
+
+    monkeypatch.setattr(conf, "get", lambda section, key: "0")
+    assert get_concurrency("split_concurrency") == os.cpu_count()
+
+
+def test_save_pages(tmp_path):
+    filepath = str(tmp_path / "foo.pdf")
+    writer = PdfWriter()
+    for width in [100, 200, 300]:
+        writer.add_blank_page(width=width, height=100)
+    with open(filepath, "wb") as f:
+        writer.write(f)
+
+    outpaths = save_pages(filepath, [1, 3])
+    assert sorted(outpaths) == [1, 3]
+    for page, width in [(1, 100), (3, 300)]:
+        infile = PdfReader(outpaths[page])
+        assert len(infile.pages) == 1
+        assert infile.pages[0].mediabox.width == width
+
+
+def test_get_layout_key(tmp_path):
+    filepath = str(tmp_path / "foo.pdf")
+    writer = PdfWriter()
+    writer.add_blank_page(width=100, height=100)
+    with open(filepath, "wb") as f:
+        writer.write(f)
+
+    key = get_layout_key(filepath)
+    assert get_layout_key(filepath, char_margin=1.0) == key
+    assert get_layout_key(filepath, char_margin=2.0) != key
+
+
+def _write_result(tmp_path):
+    class Table:
+        def __init__(self, page, order, df):
+            self.page, self.order, self.df = page, order, df
+
+    tables = {
+        "foo-page-1-table-1": Table(1, 1, pd.DataFrame([["001", "bar"]])),
+        "foo-page-2-table-1": Table(
+            2, 1, pd.DataFrame([[f"{r}{c}" for c in "abc"] for r in range(4)])
+        ),
+    }
+    with ResultWriter(str(tmp_path / RESULT_FILENAME)) as writer:
+        writer.write([tables["foo-page-1-table-1"]])
+        writer.write([tables["foo-page-2-table-1"]])
+    render_files = {
+        name: {"page": t.page, "table": t.order, "shape": list(t.df.shape)}
+        for name, t in tables.items()
+    }
+    return tables, render_files
+
+
+def test_read_table(tmp_path):
+    tables, render_files = _write_result(tmp_path)
+    resultpath = str(tmp_path / RESULT_FILENAME)
+    for name, table in tables.items():
+        assert read_table(resultpath, render_files[name]).equals(table.df)
+
+    df = read_table(
+        resultpath, render_files["foo-page-2-table-1"], rows=(1, 3), columns=[2, 0]
+    )
+    assert df.values.tolist() == [["1a", "1c"], ["2a", "2c"]]
+    assert df.columns.tolist() == [0, 2]
+
+
+def test_get_export(tmp_path):
+    tables, render_files = _write_result(tmp_path)
+
+    exportpath = get_export(str(tmp_path), "foo", render_files, "csv")
+    assert exportpath == str(tmp_path / "csv" / "foo.zip")
+    with zipfile.ZipFile(exportpath) as z:
+        assert sorted(z.namelist()) == [
+            "foo-page-1-table-1.csv",
+            "foo-page-2-table-1.csv",
+        ]
+        assert z.read("foo-page-1-table-1.csv") == b'"001","bar"\n'
+
+    mtime = os.path.getmtime(exportpath)
+    assert get_export(str(tmp_path), "foo", render_files, "csv") == exportpath
+    assert os.path.getmtime(exportpath) == mtime
+    assert os.listdir(tmp_path / "csv") == ["foo.zip"]
+
+
+def test_get_excel_export(tmp_path, monkeypatch):
+    tables, render_files = _write_result(tmp_path)
+
+    monkeypatch.setattr(conf, "get", lambda section, key: "1048576")
+    exportpath = get_export(str(tmp_path), "foo", render_files, "excel")
+    assert exportpath == str(tmp_path / "excel" / "foo.xlsx")
+    sheets = pd.read_excel(exportpath, sheet_name=None, dtype=str)
+    assert list(sheets) == ["Table_1", "Table_2"]
+    assert sheets["Table_2"].equals(tables["foo-page-2-table-1"].df)
+
+    # a workbook holds at most 3 rows, so the second table is split
+    # across two more workbooks of one sheet each
+    monkeypatch.setattr(conf, "get", lambda section, key: "3")
+    os.remove(exportpath)
+    exportpath = get_export(str(tmp_path), "foo", render_files, "excel")
+    assert exportpath == str(tmp_path / "excel" / "foo.zip")
+    with zipfile.ZipFile(exportpath) as z:
+        assert z.namelist() == ["foo.xlsx", "foo-2.xlsx", "foo-3.xlsx"]
+        sheets = [
+            pd.read_excel(io.BytesIO(z.read(name)), sheet_name=None, dtype=str)
+            for name in z.namelist()
+        ]
+    assert [list(s) for s in sheets] == [["Table_1"], ["Table_2"], ["Table_2_2"]]
+    assert sheets[2]["Table_2_2"].values.tolist() == [
+        ["2a", "2b", "2c"],
+        ["3a", "3b", "3c"],
+    ]
+
+
+def test_get_result_key():
+    rule_options = {"flavor": "lattice", "pages": {"1": {"table_areas": None}}}
+    key = get_result_key("abc", rule_options, ["1", "2"])
+    assert key == get_result_key(
+        "abc", {"pages": {"1": {"table_areas": None}}, "flavor": "lattice"}, ["2", "1"]
+    )
+    assert key != get_result_key("abd", rule_options, ["1", "2"])
+    assert key != get_result_key("abc", dict(rule_options, flavor="stream"), ["1", "2"])
+    assert key != get_result_key("abc", rule_options, ["1"])
+
+
+class RecordingScheduler(PageScheduler):
+    # hands units to a pool that only records them, and whose futures the
+    # test finishes
+    def _make_pool(self):
+        class Pool:
+            def submit(pool, fn, initializer, initargs, func, args):
+                future = Future()
+                self.submitted.append((args[0], future))
+                return future
+
+            def shutdown(pool, wait=True):
+                pass
+
+        if not hasattr(self, "submitted"):
+            self.submitted = []
+        return Pool()
+
+
+def test_page_scheduler_round_robin():
+    scheduler = RecordingScheduler(1)
+    futures = [scheduler.submit("a", str, f"a{i}") for i in range(3)]
+    futures += [scheduler.submit("b", str, f"b{i}") for i in range(3)]
+    while not all(future.done() for future in futures):
+        unit, future = next((u, f) for u, f in scheduler.submitted if not f.done())
+        future.set_result(unit)
+    assert [unit for unit, __ in scheduler.submitted] == [
+        "a0",
+        "a1",
+        "b0",
+        "a2",
+        "b1",
+        "b2",
+    ]
+    assert [future.result() for future in futures] == [
+        "a0",
+        "a1",
+        "a2",
+        "b0",
+        "b1",
+        "b2",
+    ]
+
+
+def test_page_scheduler_broken_pool():
+    scheduler = RecordingScheduler(1)
+    first = scheduler.submit("a", str, "a0")
+    second = scheduler.submit("a", str, "a1")
+    # the unit is run again when its pool breaks, and fails if it breaks
+    # the pool again, while the units after it still run
+    scheduler.submitted[0][1].set_exception(BrokenProcessPool())
+    assert [unit for unit, __ in scheduler.submitted] == ["a0", "a0"]
+    scheduler.submitted[1][1].set_exception(BrokenProcessPool())
+    assert isinstance(first.exception(), BrokenProcessPool)
+    scheduler.submitted[2][1].set_result("a1")
+    assert second.result() == "a1"